@@ -0,0 +1,151 @@
+"""
+Benchmark message text rendering on a recorded corpus of real payloads.
+
+Compares `slackcli.message.format_text_item` with the original if/elif
+renderer, which is kept below as the baseline.  The corpus is either a JSON
+Lines file, such as one written by ``slack_history.py --export``, or every
+message in the workspace's local message store.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_render WORKSPACE [--corpus FILE.jsonl]
+"""
+
+import argparse
+import json
+import sys
+import time
+
+from rich.markup import escape
+
+from slackcli.channel import get_channel_info
+from slackcli.config import load_config
+from slackcli.directory import load_directory
+from slackcli.filecache import init_filecache
+from slackcli.message import format_text_item
+from slackcli.user import get_user_info
+
+
+def main(args):
+    """
+    The main program entrypoint.
+    """
+    config = load_config(args.workspace)
+    load_directory(config, args.workspace)
+    corpus = load_corpus(args)
+    if len(corpus) == 0:
+        print("The corpus is empty.", file=sys.stderr)
+        sys.exit(1)
+    for item in corpus:
+        if format_text_item(item) != baseline_format_text_item(item):
+            print(f"Output differs for message {item['ts']}.", file=sys.stderr)
+            sys.exit(1)
+    baseline = measure(baseline_format_text_item, corpus, args.rounds)
+    current = measure(format_text_item, corpus, args.rounds)
+    print(f"Corpus: {len(corpus)} messages, {args.rounds} rounds")
+    print(f"baseline: {baseline:12.0f} messages/sec")
+    print(f"current:  {current:12.0f} messages/sec")
+    print(f"speedup:  {current / baseline:12.2f}x")
+
+
+def load_corpus(args):
+    """
+    Return the list of message payloads to render.
+    """
+    if args.corpus is not None:
+        with open(args.corpus) as f:
+            return [json.loads(line) for line in f if line.strip() != ""]
+    with init_filecache(args.workspace) as db:
+        sql = """\
+              SELECT message
+              FROM messages
+              ORDER BY posted
+              """
+        return [json.loads(message) for (message,) in db.execute(sql)]
+
+
+def measure(format_func, corpus, rounds):
+    """
+    Return the best messages/sec achieved by `format_func` over `rounds`
+    passes through the corpus.
+    """
+    best = 0.0
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for item in corpus:
+            format_func(item)
+        elapsed = time.perf_counter() - start
+        best = max(best, len(corpus) / elapsed)
+    return best
+
+
+def baseline_format_text_item(item):
+    """
+    The original renderer, kept as the benchmark baseline.
+    """
+    parts = []
+    blocks = item.get("blocks", [])
+    for block in blocks:
+        outer_elements = block["elements"]
+        for outer_element in outer_elements:
+            inner_elements = outer_element["elements"]
+            for inner_element in inner_elements:
+                elm_type = inner_element["type"]
+                if elm_type == "text":
+                    parts.append(escape(inner_element["text"]))
+                elif elm_type == "link":
+                    link = inner_element["url"]
+                    text = inner_element.get("text", link)
+                    link = escape(link)
+                    text = escape(text)
+                    markup = (
+                        f"[hyperlink][link={link}]{text} ({link})[/link][/hyperlink]"
+                    )
+                    parts.append(markup)
+                elif elm_type == "emoji":
+                    unicode_hex = inner_element.get("unicode")
+                    if unicode_hex is None:
+                        parts.append(f":{inner_element['name']}:")
+                    else:
+                        hexes = unicode_hex.split("-")
+                        parts.append("".join(chr(int(code, 16)) for code in hexes))
+                elif elm_type == "user":
+                    user_id = inner_element["user_id"]
+                    user_info = get_user_info(user_id)
+                    if user_info is None:
+                        username = user_id
+                    else:
+                        username = user_info.name
+                    parts.append(f"[user]@{escape(username)}[/user]")
+                elif elm_type == "channel":
+                    channel_id = inner_element["channel_id"]
+                    channel_info = get_channel_info(channel_id)
+                    if channel_info is None:
+                        channel = channel_id
+                    else:
+                        channel = channel_info.name
+                    parts.append(f"[channel]#{escape(channel)}[/channel]")
+    return "".join(parts)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Benchmark message rendering.")
+    parser.add_argument(
+        "workspace",
+        action="store",
+        help="Slack Workspace",
+    )
+    parser.add_argument(
+        "--corpus",
+        help="A JSON Lines file of message payloads."
+        "  Defaults to the messages in the local message store.",
+    )
+    parser.add_argument(
+        "-r",
+        "--rounds",
+        default=5,
+        type=int,
+        help="The number of passes through the corpus.",
+    )
+    args = parser.parse_args()
+    main(args)
@@ -23,7 +23,7 @@ def main(args):
     table.add_column("is_mpim", style="white", no_wrap=True)
     table.add_column("is_private", style="white", no_wrap=True)
     table.add_column("is_archived", style="white", no_wrap=True)
-    for entry in query_channels(config):
+    for entry in query_channels(config, exclude_archived=False):
         table.add_row(
             entry["id"],
             entry["name"],
@@ -2,13 +2,23 @@
 
 import argparse
 import datetime
+import shutil
 import sys
 
 from dateutil.tz import tzlocal
 from rich.table import Table
 
+from slackcli.config import load_config
 from slackcli.console import console
-from slackcli.filecache import get_file_from_cache, get_file_info, init_filecache
+from slackcli.filecache import (
+    EVICTION_POLICIES,
+    get_cache_budget,
+    get_cache_stats,
+    get_file_from_cache,
+    get_file_info,
+    init_filecache,
+    prune_cache,
+)
 
 
 def handle_list_command(filecache, args):
@@ -41,8 +51,50 @@ def handle_copy_command(filecache, args):
     if file_data is None:
         print(f"Could not retrieve file with ID {file_id}.", file=sys.stderr)
         sys.exit(1)
-    with open(file_path, "wb") as f:
-        f.write(file_data.read())
+    with file_data, open(file_path, "wb") as f:
+        shutil.copyfileobj(file_data, f)
+
+
+def handle_stats_command(filecache, args):
+    """
+    Display file cache statistics.
+    """
+    config = load_config(args.workspace)
+    max_bytes, policy = get_cache_budget(config)
+    stats = get_cache_stats(filecache)
+    lookups = stats["hits"] + stats["misses"]
+    if lookups == 0:
+        hit_ratio = "n/a"
+    else:
+        hit_ratio = f"{stats['hits'] / lookups:.1%}"
+    table = Table(title="File cache statistics")
+    table.add_column("Statistic", style="cyan", no_wrap=True)
+    table.add_column("Value", style="white", no_wrap=True)
+    table.add_row("Cached files", str(stats["files"]))
+    table.add_row("Stored blobs", str(stats["blobs"]))
+    table.add_row("Bytes used", str(stats["bytes"]))
+    table.add_row("Byte budget", str(max_bytes))
+    table.add_row("Eviction policy", policy)
+    table.add_row("Hits", str(stats["hits"]))
+    table.add_row("Misses", str(stats["misses"]))
+    table.add_row("Hit ratio", hit_ratio)
+    console.print(table)
+
+
+def handle_prune_command(filecache, args):
+    """
+    Evict files from the file cache until it fits the byte budget.
+    """
+    config = load_config(args.workspace)
+    max_bytes, policy = get_cache_budget(config)
+    if args.max_bytes is not None:
+        max_bytes = args.max_bytes
+    if args.policy is not None:
+        policy = args.policy
+    evicted = prune_cache(filecache, max_bytes, policy=policy)
+    print(f"Evicted {evicted} files.")
+    if args.vacuum:
+        filecache.execute("VACUUM")
 
 
 if __name__ == "__main__":
@@ -63,6 +115,27 @@ if __name__ == "__main__":
     parser_copy.add_argument("file_id", help="The ID of the file to copy.")
     parser_copy.add_argument("filename", help="Copy cached file to FILENAME.")
     parser_copy.set_defaults(dispatcher=handle_copy_command)
+    parser_stats = subparsers.add_parser("stats", help="Show file cache statistics.")
+    parser_stats.set_defaults(dispatcher=handle_stats_command)
+    parser_prune = subparsers.add_parser(
+        "prune", help="Evict files until the cache fits its byte budget."
+    )
+    parser_prune.add_argument(
+        "--max-bytes",
+        type=int,
+        help="Prune to MAX_BYTES instead of the configured budget.",
+    )
+    parser_prune.add_argument(
+        "--policy",
+        choices=EVICTION_POLICIES,
+        help="Eviction policy to use instead of the configured one.",
+    )
+    parser_prune.add_argument(
+        "--vacuum",
+        action="store_true",
+        help="Also compact the workspace DB to return freed space.",
+    )
+    parser_prune.set_defaults(dispatcher=handle_prune_command)
     args = parser.parse_args()
     with init_filecache(args.workspace) as filecache:
         args.dispatcher(filecache, args)
@@ -1,17 +1,33 @@
 #! /usr/bin/env python
 
 import argparse
+import concurrent.futures
+import contextlib
 import datetime
+import json
+import os
+import pathlib
 import sys
 
-import httpx
 from rich import inspect
 
-from slackcli.channel import get_channel_id_by_name, load_channels
+from slackcli.api import get_client
+from slackcli.channel import get_channel_id_by_name, get_channels_by_type
 from slackcli.config import load_config
+from slackcli.console import console
+from slackcli.directory import load_directory
 from slackcli.filecache import init_filecache
 from slackcli.message import display_message_item
-from slackcli.user import load_users
+from slackcli.messagestore import (
+    get_stored_messages,
+    query_history,
+    sync_channel_history,
+)
+from slackcli.output import DEFAULT_BATCH_SIZE, BatchWriter, PlainWriter
+from slackcli.prefetch import DEFAULT_PREFETCH_WORKERS, prefetch_message_files
+from slackcli.records import RECORD_FORMATS, RecordWriter
+
+DEFAULT_EXPORT_WORKERS = 8
 
 
 def main(args):
@@ -19,18 +35,46 @@ def main(args):
     The main program entrypoint.
     """
     config = load_config(args.workspace)
-    load_channels(config)
-    load_users(config)
-    channel_id = get_channel_id_by_name(args.channel)
+    load_directory(config, args.workspace, refresh=args.refresh_directory)
+    if args.export is not None:
+        export_channels(args, config)
+        return
+    if len(args.channel) != 1:
+        print("Exactly one channel must be given unless exporting.")
+        sys.exit(1)
+    channel_name = args.channel[0]
+    channel_id = get_channel_id_by_name(channel_name)
     if channel_id is None:
-        print(f"Channel '{args.channel}' could not be found.")
+        print(f"Channel '{channel_name}' could not be found.")
         sys.exit(1)
-    if args.pins:
-        results = get_pins_for_channel(channel_id, config)
-    else:
-        results = get_history_for_channel(channel_id, args.days, config)
-    item = None
     with init_filecache(args.workspace) as filecache:
+        if args.pins:
+            results = get_pins_for_channel(channel_id, config)
+        else:
+            results = get_history_for_channel(
+                channel_id, args.days, config, filecache, resync=args.resync
+            )
+        if args.format == "rich":
+            item = display_history_(results, args, config, filecache)
+        else:
+            item = write_records_(results, channel_id, args.format)
+    if item:
+        mark_read(channel_id, item["ts"], config)
+
+
+def display_history_(results, args, config, filecache):
+    """
+    Display history items.
+    Returns the last item displayed, or None if there were no items.
+    """
+    writer = make_writer_(args)
+    # Plain output does not render images, so it does not prefetch files.
+    if not args.no_files and writer.images and args.prefetch_workers > 0:
+        results = prefetch_message_files(
+            results, config, args.workspace, workers=args.prefetch_workers
+        )
+    item = None
+    with make_pager_context_(args):
         for item in results:
             display_message_item(
                 item,
@@ -38,20 +82,126 @@ def main(args):
                 filecache,
                 show_thread_id=args.show_thread_id,
                 no_files=args.no_files,
+                writer=writer,
             )
-    if item:
-        mark_read(channel_id, item["ts"], config)
+        writer.flush()
+    return item
+
+
+def write_records_(results, channel_id, format_name):
+    """
+    Stream one machine-readable record per history item to STDOUT.
+    Returns the last item written, or None if there were no items.
+    """
+    item = None
+    record_writer = RecordWriter(sys.stdout, format_name)
+    for item in results:
+        record_writer.write(channel_id, item)
+    record_writer.flush()
+    return item
+
+
+def make_writer_(args):
+    """
+    Return the writer for displayed history.
+    Output that is not a terminal is written as plain text.  Otherwise lines
+    are written to the console in batches.
+    """
+    if not console.is_terminal:
+        return PlainWriter(sys.stdout)
+    return BatchWriter(console, batch_size=args.batch_size, pager=args.pager)
+
+
+def make_pager_context_(args):
+    """
+    Return a context manager that sends console output to a pager when
+    requested and the output is a terminal.
+    """
+    if args.pager and console.is_terminal:
+        return console.pager(styles=True)
+    return contextlib.nullcontext()
+
+
+def export_channels(args, config):
+    """
+    Export the history of many channels concurrently to JSON Lines files in
+    the export directory, one file per channel.
+    """
+    channels = {}
+    if args.all_channels:
+        channels.update(get_channels_by_type("channel"))
+    for channel_name in args.channel:
+        channel_id = get_channel_id_by_name(channel_name)
+        if channel_id is None:
+            print(f"Channel '{channel_name}' could not be found.")
+            sys.exit(1)
+        channels[channel_id] = channel_name
+    if len(channels) == 0:
+        print("No channels to export.")
+        sys.exit(1)
+    export_dir = pathlib.Path(args.export).expanduser()
+    export_dir.mkdir(parents=True, exist_ok=True)
+    oldest = (datetime.datetime.today() - datetime.timedelta(args.days)).timestamp()
+    failed = False
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {
+            executor.submit(
+                export_channel_history,
+                channel_id,
+                oldest,
+                config,
+                export_dir / f"{channel_name}.jsonl",
+            ): channel_name
+            for channel_id, channel_name in channels.items()
+        }
+        for future in concurrent.futures.as_completed(futures):
+            channel_name = futures[future]
+            try:
+                count = future.result()
+            except Exception as ex:
+                print(
+                    f"Could not export channel '{channel_name}': {ex}",
+                    file=sys.stderr,
+                )
+                failed = True
+                continue
+            print(f"Exported {count} messages from channel '{channel_name}'.")
+    stats = get_client(config).get_stats()
+    print(
+        f"Made {stats['requests']} API requests;"
+        f" {stats['throttled']} throttled, {stats['rate_limited']} rate limited,"
+        f" {stats['retried']} retried."
+    )
+    if failed:
+        sys.exit(1)
+
+
+def export_channel_history(channel_id, oldest, config, path):
+    """
+    Stream the history of the channel specified by channel ID posted after
+    the timestamp `oldest` to the JSON Lines file at `path`, newest first.
+    The file is written under a temporary name and only replaces `path` once
+    the export is complete.
+    Returns the number of messages exported.
+    """
+    count = 0
+    part_path = path.with_name(f"{path.name}.part")
+    with open(part_path, "w") as f:
+        for message in query_history(config, channel_id, oldest):
+            f.write(json.dumps(message))
+            f.write("\n")
+            count += 1
+    os.replace(part_path, path)
+    return count
 
 
 def mark_read(channel_id, ts, config):
     """
     Mark the message identified by ``channel_id`` and ``ts`` as read.
     """
-    user_token = config["oauth"]["user_token"]
-    headers = {"Authorization": f"Bearer {user_token}"}
-    url = "https://slack.com/api/conversations.mark"
+    client = get_client(config)
     params = {"channel": channel_id, "ts": ts}
-    r = httpx.post(url, params=params, headers=headers)
+    r = client.post("conversations.mark", params=params)
     if r.status_code != 200:
         print(
             f"Got status {r.status_code} when fetching"
@@ -68,11 +218,9 @@ def get_pins_for_channel(channel_id, config):
     """
     Get the pins for a channel.
     """
-    user_token = config["oauth"]["user_token"]
-    headers = {"Authorization": f"Bearer {user_token}"}
-    url = "https://slack.com/api/pins.list"
+    client = get_client(config)
     params = {"channel": channel_id}
-    r = httpx.get(url, params=params, headers=headers)
+    r = client.get("pins.list", params=params)
     if r.status_code != 200:
         print(
             f"Got status {r.status_code} when fetching"
@@ -88,44 +236,16 @@ def get_pins_for_channel(channel_id, config):
             yield message
 
 
-def get_history_for_channel(channel_id, days, config):
+def get_history_for_channel(channel_id, days, config, db, resync=False):
     """
     Generator produces `days` days worth of history from the channel specified
     by channel ID.
+    Only messages newer than those in the local message store are fetched
+    from the API.
     """
-    user_token = config["oauth"]["user_token"]
-    headers = {"Authorization": f"Bearer {user_token}"}
-    url = "https://slack.com/api/conversations.history"
     ts = (datetime.datetime.today() - datetime.timedelta(days)).timestamp()
-    params = {"channel": channel_id, "limit": 100, "oldest": ts}
-    for json_response in page_results(httpx.get, url, params=params, headers=headers):
-        messages = json_response["messages"]
-        messages.reverse()
-        for message in messages:
-            yield message
-
-
-def page_results(request_func, url, params, headers):
-    """
-    Generator pages results for web API requests.
-    """
-    orig_params = dict(params)
-    while True:
-        r = request_func(url, params=params, headers=headers)
-        r.raise_for_status()
-        json_response = r.json()
-        yield json_response
-        has_more = json_response.get("has_more", False)
-        if not has_more:
-            break
-        response_metadata = json_response["response_metadata"]
-        try:
-            cursor = response_metadata["next_cursor"]
-        except KeyError:
-            inspect(response_metadata)
-            raise
-        params = dict(orig_params)
-        params["cursor"] = cursor
+    sync_channel_history(db, config, channel_id, ts, resync=resync)
+    yield from get_stored_messages(db, channel_id, ts)
 
 
 if __name__ == "__main__":
@@ -138,7 +258,9 @@ if __name__ == "__main__":
     parser.add_argument(
         "channel",
         action="store",
-        help="The name of the channel to display history from.",
+        nargs="*",
+        help="The name of the channel to display history from."
+        "  Several channels may be given when exporting.",
     )
     parser.add_argument(
         "-d",
@@ -164,5 +286,60 @@ if __name__ == "__main__":
         action="store_true",
         help="Only show text messages.  Don't download or display files.",
     )
+    parser.add_argument(
+        "-f",
+        "--format",
+        choices=("rich",) + RECORD_FORMATS,
+        default="rich",
+        help="Output format.  Formats other than 'rich' stream one"
+        " machine-readable record per message.",
+    )
+    parser.add_argument(
+        "--pager",
+        action="store_true",
+        help="Display history in a pager.",
+    )
+    parser.add_argument(
+        "--batch-size",
+        default=DEFAULT_BATCH_SIZE,
+        type=int,
+        help="The number of lines written to the terminal at a time.",
+    )
+    parser.add_argument(
+        "--prefetch-workers",
+        default=DEFAULT_PREFETCH_WORKERS,
+        type=int,
+        help="The number of files to download concurrently ahead of display."
+        "  Use 0 to download each file as it is displayed.",
+    )
+    parser.add_argument(
+        "--resync",
+        action="store_true",
+        help="Fetch the full history range from Slack instead of only"
+        " messages newer than those stored locally.",
+    )
+    parser.add_argument(
+        "--export",
+        metavar="DIR",
+        help="Export the history of each channel to DIR/CHANNEL.jsonl"
+        " instead of displaying it.",
+    )
+    parser.add_argument(
+        "--all-channels",
+        action="store_true",
+        help="When exporting, export all channels.",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        default=DEFAULT_EXPORT_WORKERS,
+        type=int,
+        help="The number of channels to export concurrently.",
+    )
+    parser.add_argument(
+        "--refresh-directory",
+        action="store_true",
+        help="Refresh the cached channel and user directory from Slack.",
+    )
     args = parser.parse_args()
     main(args)
@@ -1,8 +1,13 @@
 #! /usr/bin/env python
 
 import argparse
-import queue
+import collections
+import concurrent.futures
+import json
+import sys
 import threading
+import time
+import zlib
 
 import logzero
 from logzero import logger
@@ -15,19 +20,72 @@ from slackcli.channel import (
     get_all_channel_ids,
     get_channel_id_by_name,
     get_channel_info,
-    load_channels,
     load_dm_info,
 )
 from slackcli.config import load_config
 from slackcli.console import console
-from slackcli.filecache import init_filecache
-from slackcli.message import display_message_item
-from slackcli.user import get_user_info, load_users
+from slackcli.directory import load_directory
+from slackcli.eventqueue import (
+    DEFAULT_MAX_SIZE,
+    DEFAULT_OVERFLOW_POLICY,
+    EventQueue,
+)
+from slackcli.filecache import get_file, init_filecache, open_filecache
+from slackcli.image import render_image
+from slackcli.message import display_message_item, get_render_db
+from slackcli.messagestore import query_history
+from slackcli.output import BufferWriter, ConsoleWriter
+from slackcli.records import RECORD_FORMATS, RecordWriter
+from slackcli.user import get_user_info
 
 app = None
-q = queue.Queue()
+# Display queues, one per display worker.  Each channel is assigned to one
+# queue so its messages are displayed in order.
+queues_ = []
 current_channel = None
-dm_map_ = {}
+record_writer_ = None
+console_writer_ = ConsoleWriter(console)
+# Serializes terminal output and the current channel banner.
+display_lock_ = threading.Lock()
+DEFAULT_DISPLAY_WORKERS = 4
+DEFAULT_MARK_INTERVAL = 5
+DEFAULT_MARK_SWITCH_INTERVAL = 1
+DEFAULT_STATS_INTERVAL = 60
+# Keys of recently queued events, used to drop redelivered events.  Entries
+# expire after REPLAY_WINDOW seconds and at most REPLAY_SIZE are kept.
+REPLAY_SIZE = 10000
+REPLAY_WINDOW = 600
+seen_events_ = collections.OrderedDict()
+seen_lock_ = threading.Lock()
+DEFAULT_BACKFILL_WORKERS = 8
+DEFAULT_BACKFILL_MAX_AGE = 3600
+# Channels whose messages are displayed, other than DMs.
+listening_ = frozenset()
+# (ts, channel_type) of the latest message queued for each displayed channel
+# that has delivered a message, used to fetch messages missed while the
+# socket was disconnected.
+last_seen_ = {}
+last_seen_lock_ = threading.Lock()
+connections_ = 0
+# While backfills are running, live messages for the channels being
+# backfilled are held here so they are displayed after the missed messages.
+backfills_running_ = 0
+held_channels_ = set()
+held_events_ = []
+# Latest displayed ts per channel, waiting to be marked as read.
+pending_marks_ = {}
+mark_lock_ = threading.Lock()
+mark_channel_ = None
+# Channels switched away from whose pending marks should be sent early.
+left_channels_ = set()
+mark_event_ = threading.Event()
+DEFAULT_IMAGE_WORKERS = 4
+image_pool_ = None
+image_local_ = threading.local()
+# Per-channel sequence numbers used to display images in message order.
+image_seq_ = collections.defaultdict(int)
+image_next_seq_ = collections.defaultdict(int)
+image_pending_ = collections.defaultdict(dict)
 
 
 def init(args):
@@ -50,15 +108,32 @@ def main(args):
     Main program entrypoint.
     """
     global app
+    global listening_
+    global record_writer_
     config = load_config(args.workspace)
-    load_channels(config)
-    load_users(config)
+    load_directory(config, args.workspace, refresh=args.refresh_directory)
+    if args.format != "rich":
+        record_writer_ = RecordWriter(sys.stdout, args.format)
     listening = create_channel_filters(config)
+    listening_ = listening
     start_worker_thread(config, args.workspace, listening)
+    start_mark_thread(config)
     app_token = config["oauth"]["app_token"]
     logger.info("Starting Socket-mode handler.")
-    SocketModeHandler(app, app_token).start()
-    q.join()
+    handler = SocketModeHandler(app, app_token)
+
+    def on_socket_message(message):
+        handle_socket_message(config, message)
+
+    handler.client.on_message_listeners.append(on_socket_message)
+    try:
+        handler.start()
+        for shard_queue in queues_:
+            shard_queue.join()
+    finally:
+        # The handler only returns by raising, e.g. KeyboardInterrupt.
+        flush_marks_()
+        log_queue_stats_()
 
 
 def create_channel_filters(config):
@@ -79,17 +154,25 @@ def create_channel_filters(config):
     return listening
 
 
-def worker(config, workspace, listening):
-
-    with init_filecache(args.workspace) as filecache:
+def worker(config, workspace, listening, shard_queue):
+    """
+    Display worker drains one display queue.
+    Messages are rendered concurrently with other workers; only writing to
+    the terminal is serialized.
+    """
+    with init_filecache(workspace) as filecache:
         while True:
-            task_type, data = q.get()
+            task_type, data = shard_queue.get()
             if task_type == "display":
-                worker_display_message(data, config, filecache, listening)
-            q.task_done()
+                worker_display_message(data, config, filecache, listening, shard_queue)
+            elif task_type == "image":
+                worker_display_image(data, config)
+            elif task_type == "collapsed":
+                worker_display_collapsed(data)
+            shard_queue.task_done()
 
 
-def worker_display_message(data, config, filecache, listening):
+def worker_display_message(data, config, filecache, listening, shard_queue):
     """
     Display a message.
     """
@@ -99,20 +182,203 @@ def worker_display_message(data, config, filecache, listening):
     if channel_type != "im":
         if channel_id not in listening:
             return
-    check_display_channel(config, channel_id, channel_type)
+    if record_writer_ is not None:
+        write_message_record(channel_id, message, shard_queue)
+        return
+    writer = BufferWriter()
+
+    def image_handler(item, file_info):
+        queue_image_render(config, channel_id, channel_type, file_info, writer)
+
     try:
-        display_message_item(message, config, filecache, show_thread_id=True)
+        display_message_item(
+            message,
+            config,
+            filecache,
+            show_thread_id=True,
+            image_handler=image_handler,
+            writer=writer,
+        )
     except Exception as ex:
-        inspect(ex)
-        inspect(message)
-    ts = message["ts"]
-    app.client.conversations_mark(channel=channel_id, ts=ts)
+        with display_lock_:
+            inspect(ex)
+            inspect(message)
+    with display_lock_:
+        check_display_channel(config, channel_id, channel_type)
+        writer.write_to(console_writer_)
+    queue_mark(channel_id, message["ts"])
+
+
+def write_message_record(channel_id, message, shard_queue):
+    """
+    Write a machine-readable record for a message.
+    Output is flushed once the worker's queue has been drained.
+    """
+    with display_lock_:
+        record_writer_.write(channel_id, message)
+        if shard_queue.empty():
+            record_writer_.flush()
+    queue_mark(channel_id, message["ts"])
+
+
+def queue_mark(channel_id, ts):
+    """
+    Queue the message identified by `channel_id` and `ts` to be marked as
+    read.
+    Only the latest message in each channel is marked.  The pending mark of a
+    channel is sent when another channel is displayed, and all pending marks
+    are sent when the mark interval elapses.
+    """
+    global mark_channel_
+    with mark_lock_:
+        pending_ts = pending_marks_.get(channel_id)
+        if pending_ts is None or float(ts) > float(pending_ts):
+            pending_marks_[channel_id] = ts
+        switched = mark_channel_ is not None and channel_id != mark_channel_
+        if switched:
+            left_channels_.add(mark_channel_)
+            left_channels_.discard(channel_id)
+        mark_channel_ = channel_id
+    if switched:
+        mark_event_.set()
+
+
+def mark_worker(interval, switch_interval):
+    """
+    Mark worker sends pending marks in the background.
+    Marks for channels that were switched away from are sent at most once
+    every `switch_interval` seconds, so interleaved channels don't cause a
+    request per message.
+    """
+    flush_at = time.monotonic() + interval
+    while True:
+        mark_event_.wait(max(0, flush_at - time.monotonic()))
+        if time.monotonic() >= flush_at:
+            mark_event_.clear()
+            flush_marks_()
+            flush_at = time.monotonic() + interval
+        else:
+            mark_event_.clear()
+            flush_marks_(left_only=True)
+            time.sleep(switch_interval)
+
+
+def flush_marks_(left_only=False):
+    """
+    Mark the latest displayed message in each channel with pending marks as
+    read.
+    If `left_only` is True, only channels that were switched away from are
+    marked.
+    """
+    global pending_marks_
+    with mark_lock_:
+        if left_only:
+            marks = {
+                channel_id: pending_marks_.pop(channel_id)
+                for channel_id in left_channels_
+                if channel_id in pending_marks_
+            }
+        else:
+            marks = pending_marks_
+            pending_marks_ = {}
+        left_channels_.clear()
+    for channel_id, ts in marks.items():
+        try:
+            app.client.conversations_mark(channel=channel_id, ts=ts)
+        except Exception as ex:
+            logger.warning(f"Could not mark channel {channel_id} as read: {ex}")
+
+
+def queue_image_render(config, channel_id, channel_type, file_info, writer):
+    """
+    Write a placeholder for an image and render it in the image worker pool.
+    The rendered image is queued for display once it is ready.
+    """
+    seq = image_seq_[channel_id]
+    image_seq_[channel_id] = seq + 1
+    name = file_info["name"]
+    writer.markup(f"[image]{escape(name)} (loading image)[/image]")
+    future = image_pool_.submit(render_image_task, config, file_info)
+
+    def on_done(future):
+        try:
+            output = future.result()
+        except Exception as ex:
+            logger.warning(f"Could not render image '{name}': {ex}")
+            output = None
+        get_queue_(channel_id).put(
+            ("image", (channel_id, channel_type, seq, name, output))
+        )
+
+    future.add_done_callback(on_done)
+
+
+def render_image_task(config, file_info):
+    """
+    Download and render an image in an image worker thread.
+    Returns the rendered output, or None if the image could not be retrieved.
+    """
+    filecache = image_local_.filecache
+    file_data = get_file(filecache, config, file_info)
+    if file_data is None:
+        return None
+    with file_data:
+        return render_image(file_data, db=get_render_db(config, filecache))
+
+
+def init_image_worker(workspace):
+    """
+    Open the file cache connection used by an image worker thread.
+    """
+    image_local_.filecache = open_filecache(workspace)
+
+
+def worker_display_image(data, config):
+    """
+    Display a rendered image.
+    Images are displayed in the order their messages were displayed within
+    each channel, so an image that is ready early waits for the images
+    before it.
+    """
+    channel_id, channel_type, seq, name, output = data
+    pending = image_pending_[channel_id]
+    pending[seq] = (channel_type, name, output)
+    next_seq = image_next_seq_[channel_id]
+    while next_seq in pending:
+        channel_type, name, output = pending.pop(next_seq)
+        with display_lock_:
+            check_display_channel(config, channel_id, channel_type)
+            if output is not None:
+                console_writer_.raw(output)
+            console_writer_.markup(f"[file]{escape(name)}[/file]")
+        next_seq += 1
+    image_next_seq_[channel_id] = next_seq
+
+
+def worker_display_collapsed(data):
+    """
+    Report messages that were skipped because the display queue was full.
+    """
+    channel_id, count = data
+    channel_info = get_channel_info(channel_id)
+    if channel_info is None:
+        channel_name = channel_id
+    else:
+        channel_name = channel_info.name
+    noun = "message" if count == 1 else "messages"
+    summary = f"{count} more {noun} in #{channel_name}"
+    with display_lock_:
+        if record_writer_ is None:
+            console_writer_.markup(f"[error]{escape(summary)}[/error]")
+        else:
+            logger.warning(f"Skipped {summary}.")
 
 
 def check_display_channel(config, channel_id, channel_type):
     """
     Determine if the channel banner needs to be displayed.
     Display it as needed.
+    The caller must hold the display lock.
     """
     global current_channel
     if channel_id != current_channel:
@@ -123,32 +389,145 @@ def check_display_channel(config, channel_id, channel_type):
 def display_channel_banner(config, channel_id, channel_type):
     """
     Display the channel banner.
+    DM info comes from the directory, so the Slack API is only used for DMs
+    opened since it was loaded.
     """
     global style
-    global dm_map_
 
     if channel_type == "im":
-        channel_info = load_dm_info(config, channel_id)
-        user_id = channel_info["user"]
-        user_info = get_user_info(user_id)
-        user_name = user_info["name"]
+        dm_info = load_dm_info(config, channel_id)
+        user_info = get_user_info(dm_info.user)
+        if user_info is None:
+            user_name = dm_info.user
+        else:
+            user_name = user_info.name
         channel_name = f"DM with {user_name}"
+    elif channel_type == "mpim":
+        dm_info = load_dm_info(config, channel_id)
+        channel_name = dm_info.name
     else:
         channel_info = get_channel_info(channel_id)
-        channel_name = channel_info["name"]
+        channel_name = channel_info.name
     console.rule(f"[channel]{escape(channel_name)}[/channel]")
 
 
 def start_worker_thread(config, workspace, listening):
     """
-    Start the thread responsible for writing to the display.
+    Start the threads responsible for writing to the display, and the pool
+    that downloads and renders images for them.
+    """
+    global image_pool_
+    listen_cfg = config.get("listen", {})
+    display_workers = listen_cfg.get("display_workers", DEFAULT_DISPLAY_WORKERS)
+    queue_size = listen_cfg.get("queue_size", DEFAULT_MAX_SIZE)
+    overflow_policy = listen_cfg.get("overflow_policy", DEFAULT_OVERFLOW_POLICY)
+    stats_interval = listen_cfg.get("stats_interval", DEFAULT_STATS_INTERVAL)
+    image_workers = listen_cfg.get("image_workers", DEFAULT_IMAGE_WORKERS)
+    image_pool_ = concurrent.futures.ThreadPoolExecutor(
+        max_workers=image_workers,
+        initializer=init_image_worker,
+        initargs=(workspace,),
+    )
+    # Turn-on the worker threads.
+    # The queue size is shared between the display queues.
+    shard_size = max(1, queue_size // display_workers)
+    for _ in range(display_workers):
+        shard_queue = EventQueue(shard_size, overflow_policy)
+        queues_.append(shard_queue)
+        threading.Thread(
+            target=worker,
+            daemon=True,
+            args=(config, workspace, listening, shard_queue),
+        ).start()
+    threading.Thread(target=stats_worker, daemon=True, args=(stats_interval,)).start()
+
+
+def stats_worker(interval):
+    """
+    Stats worker periodically logs the display queue metrics.
+    """
+    while True:
+        time.sleep(interval)
+        log_queue_stats_()
+
+
+def get_queue_stats():
+    """
+    Return the display queue metrics summed over all display queues.
+    `depth` is the number of queued tasks and `high_water` the sum of the
+    deepest each queue has been.
+    """
+    totals = {}
+    for shard_queue in queues_:
+        for name, value in shard_queue.get_stats().items():
+            totals[name] = totals.get(name, 0) + value
+    return totals
+
+
+def log_queue_stats_():
+    """
+    Log the display queue metrics.
+    """
+    stats = get_queue_stats()
+    logger.debug(
+        f"Display queue depth {stats['depth']}, high-water mark"
+        f" {stats['high_water']}, {stats['dropped']} dropped,"
+        f" {stats['collapsed']} collapsed."
+    )
+
+
+def is_replay_(body):
+    """
+    Return True if the event in `body` has already been queued, and
+    remember it otherwise.
+    Events are identified by their event ID, their client message ID, and
+    their channel and timestamp, so replays are caught even when Slack
+    assigns a redelivered event a new ID.
+    """
+    event = body["event"]
+    keys = [("channel", event.get("channel"), event.get("ts"))]
+    event_id = body.get("event_id")
+    if event_id is not None:
+        keys.append(("event", event_id))
+    client_msg_id = event.get("client_msg_id")
+    if client_msg_id is not None:
+        keys.append(("client_msg", client_msg_id))
+    now = time.monotonic()
+    with seen_lock_:
+        while seen_events_:
+            key, seen = next(iter(seen_events_.items()))
+            if len(seen_events_) <= REPLAY_SIZE and now - seen < REPLAY_WINDOW:
+                break
+            seen_events_.popitem(last=False)
+        if any(key in seen_events_ for key in keys):
+            return True
+        for key in keys:
+            seen_events_[key] = now
+    return False
+
+
+def start_mark_thread(config):
+    """
+    Start the thread that marks displayed messages as read.
     """
-    # Turn-on the worker thread.
+    listen_cfg = config.get("listen", {})
+    interval = listen_cfg.get("mark_interval", DEFAULT_MARK_INTERVAL)
+    switch_interval = listen_cfg.get(
+        "mark_switch_interval", DEFAULT_MARK_SWITCH_INTERVAL
+    )
     threading.Thread(
-        target=worker, daemon=True, args=(config, workspace, listening)
+        target=mark_worker, daemon=True, args=(interval, switch_interval)
     ).start()
 
 
+def get_queue_(channel_id):
+    """
+    Return the display queue for the channel.
+    """
+    shard = zlib.crc32(channel_id.encode()) % len(queues_)
+    return queues_[shard]
+
+
 def init_app(config):
     """
     Initialize app.
@@ -160,29 +539,161 @@ def init_app(config):
     app = App(token=user_token)
 
 
+def handle_socket_message(config, message):
+    """
+    Watch for the "hello" message sent when the socket connects.
+    After a reconnect, messages missed while disconnected are fetched in the
+    background.
+    """
+    global connections_
+    global backfills_running_
+    if isinstance(message, str):
+        # Avoid parsing every event payload just to find the hello message.
+        if '"hello"' not in message:
+            return
+        message = json.loads(message)
+    if message.get("type") != "hello":
+        return
+    connections_ += 1
+    if connections_ == 1:
+        return
+    logger.info("Socket reconnected; fetching missed messages.")
+    with last_seen_lock_:
+        last_seen = dict(last_seen_)
+        backfills_running_ += 1
+        held_channels_.update(last_seen.keys())
+    threading.Thread(
+        target=backfill_messages, daemon=True, args=(config, last_seen)
+    ).start()
+
+
+def backfill_messages(config, last_seen):
+    """
+    Fetch messages posted since the latest message queued for each channel
+    that has delivered a message to the listener, and queue them for display
+    in timestamp order.
+    `last_seen` maps the channel IDs to the (ts, channel_type) of their latest
+    message as of the reconnect.
+    Channels are fetched concurrently.  Messages older than
+    `backfill_max_age` seconds are not fetched.
+    Live messages held while the backfill ran are queued afterwards.
+    """
+    try:
+        queue_missed_messages_(config, last_seen)
+    finally:
+        release_held_events_()
+
+
+def queue_missed_messages_(config, last_seen):
+    """
+    Fetch and queue the messages missed in each channel of `last_seen`.
+    """
+    listen_cfg = config.get("listen", {})
+    workers = listen_cfg.get("backfill_workers", DEFAULT_BACKFILL_WORKERS)
+    max_age = listen_cfg.get("backfill_max_age", DEFAULT_BACKFILL_MAX_AGE)
+    earliest = time.time() - max_age
+    messages = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for channel_id, (ts, channel_type) in last_seen.items():
+            oldest = max(float(ts), earliest)
+            future = executor.submit(list, query_history(config, channel_id, oldest))
+            futures[future] = (channel_id, channel_type)
+        for future in concurrent.futures.as_completed(futures):
+            channel_id, channel_type = futures[future]
+            try:
+                channel_messages = future.result()
+            except Exception as ex:
+                logger.warning(f"Could not fetch missed messages in {channel_id}: {ex}")
+                continue
+            for message in channel_messages:
+                messages.append(
+                    dict(message, channel=channel_id, channel_type=channel_type)
+                )
+    messages.sort(key=lambda message: float(message["ts"]))
+    logger.info(f"Fetched {len(messages)} missed messages.")
+    for message in messages:
+        queue_event_({"event": message}, hold=False)
+
+
+def release_held_events_():
+    """
+    Queue the live messages held during backfills once the last running
+    backfill has finished.
+    """
+    global backfills_running_
+    global held_events_
+    with last_seen_lock_:
+        backfills_running_ -= 1
+        if backfills_running_ > 0:
+            return
+        # Queue while holding the lock so newer live messages can't be queued
+        # ahead of the held ones.
+        for channel_id, event in held_events_:
+            queue_message(channel_id, event)
+        held_events_ = []
+        held_channels_.clear()
+
+
+def queue_event_(body, hold=True):
+    """
+    Queue the message event in `body` to be displayed, unless it is of a
+    subtype that is not displayed or has already been queued.
+    If `hold` is True, messages for channels that are being backfilled are
+    held until the backfill has been queued.
+    """
+    event = body["event"]
+    event_subtype = event.get("subtype")
+    if event_subtype in ("message_deleted", "message_changed", "channel_join"):
+        return
+    if is_replay_(body):
+        logger.debug(f"Dropped redelivered event {body.get('event_id')}.")
+        return
+    channel_id = event["channel"]
+    channel_type = event.get("channel_type")
+    if channel_type == "im" or channel_id in listening_:
+        ts = event["ts"]
+        with last_seen_lock_:
+            seen = last_seen_.get(channel_id)
+            if seen is None or float(ts) > float(seen[0]):
+                last_seen_[channel_id] = (ts, channel_type)
+            if hold and channel_id in held_channels_:
+                held_events_.append((channel_id, event))
+                return
+    queue_message(channel_id, event)
+
+
 def queue_message(channel_id, msg):
     """
     Queue a message to be displayed.
     """
-    q.put(("display", (channel_id, msg)))
+    get_queue_(channel_id).put(("display", (channel_id, msg)))
 
 
 # Start your app
 if __name__ == "__main__":
     parser = argparse.ArgumentParser("Listen to Slack Channels")
     parser.add_argument("workspace", action="store", help="Slack Workspace")
+    parser.add_argument(
+        "-f",
+        "--format",
+        choices=("rich",) + RECORD_FORMATS,
+        default="rich",
+        help="Output format.  Formats other than 'rich' stream one"
+        " machine-readable record per message.",
+    )
+    parser.add_argument(
+        "--refresh-directory",
+        action="store_true",
+        help="Refresh the cached channel and user directory from Slack.",
+    )
     args = parser.parse_args()
     init(args)
 
 
 @app.event("message")
 def handle_message_events(body, logger):
-    event = body["event"]
-    event_subtype = event.get("subtype")
-    if event_subtype in ("message_deleted", "message_changed", "channel_join"):
-        return
-    channel_id = event["channel"]
-    queue_message(channel_id, event)
+    queue_event_(body)
 
 
 @app.event("file_shared")
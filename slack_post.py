@@ -8,7 +8,6 @@ import sys
 import tempfile
 from textwrap import dedent
 
-import httpx
 from prompt_toolkit import PromptSession, prompt
 from prompt_toolkit.application import run_in_terminal
 from prompt_toolkit.completion import PathCompleter, WordCompleter
@@ -20,10 +19,12 @@ from rich import inspect
 from rich.markdown import Markdown
 from rich.markup import escape
 
-from slackcli.channel import get_channel_id_by_name, get_channels_by_type, load_channels
+from slackcli.api import get_client
+from slackcli.channel import get_channel_id_by_name, get_channels_by_type
 from slackcli.config import load_config
 from slackcli.console import console
-from slackcli.user import get_all_users, get_user_id_by_username, load_users
+from slackcli.directory import load_directory
+from slackcli.user import get_all_users, get_user_id_by_username
 
 RESULT_QUIT = 0
 RESULT_HELP = 1
@@ -47,8 +48,7 @@ def main(args):
     The main program entrypoint.
     """
     config = load_config(args.workspace)
-    load_channels(config)
-    load_users(config)
+    load_directory(config, args.workspace, refresh=args.refresh_directory)
     if not args.dm:
         channel_id = get_channel_id_by_name(args.channel)
     else:
@@ -202,10 +202,7 @@ def make_dm_completer():
     """
     Create a DM completer.
     """
-    user_map = {
-        channel_info["name"]: channel_id
-        for (channel_id, channel_info) in get_all_users()
-    }
+    user_map = {user_info.name: user_id for (user_id, user_info) in get_all_users()}
     completer = WordCompleter(user_map.keys(), ignore_case=True)
     return completer, user_map
 
@@ -464,16 +461,14 @@ def post_message(channel_id, args, config, text):
     """
     Post a text message to a channel.
     """
-    url = "https://slack.com/api/chat.postMessage"
-    user_token = config["oauth"]["user_token"]
-    headers = {"Authorization": f"Bearer {user_token}"}
+    client = get_client(config)
     params = {
         "channel": channel_id,
         "text": text,
     }
     if args.thread:
         params["thread_ts"] = args.thread
-    r = httpx.post(url, headers=headers, params=params)
+    r = client.post("chat.postMessage", params=params)
     if r.status_code != 200:
         print(
             f"Got status {r.status_code} when posting"
@@ -517,10 +512,8 @@ def upload_and_share_file_impl_(
     }
     params["filename"] = filename
     params["title"] = filename
-    url = "https://slack.com/api/files.upload"
-    user_token = config["oauth"]["user_token"]
-    headers = {"Authorization": f"Bearer {user_token}"}
-    r = httpx.post(url, headers=headers, params=params, **kwargs)
+    client = get_client(config)
+    r = client.post("files.upload", params=params, **kwargs)
     if r.status_code != 200:
         print(
             f"Got status {r.status_code} when posting"
@@ -585,5 +578,10 @@ if __name__ == "__main__":
         action="store_true",
         help="Compose messages using a Read-Eval-Print Loop.",
     )
+    parser.add_argument(
+        "--refresh-directory",
+        action="store_true",
+        help="Refresh the cached channel and user directory from Slack.",
+    )
     args = parser.parse_args()
     main(args)
@@ -0,0 +1,154 @@
+#! /usr/bin/env python
+
+import argparse
+import datetime
+import sqlite3
+import sys
+
+from rich.markup import escape
+
+from slackcli.channel import get_channel_id_by_name, get_channel_info
+from slackcli.config import load_config
+from slackcli.console import console
+from slackcli.directory import load_directory
+from slackcli.filecache import init_filecache
+from slackcli.message import display_message_item
+from slackcli.messagestore import reindex_messages, search_messages
+from slackcli.user import get_user_id_by_username
+
+
+def main(args):
+    """
+    The main program entrypoint.
+    """
+    config = load_config(args.workspace)
+    load_directory(config, args.workspace, refresh=args.refresh_directory)
+    channel_id = None
+    if args.channel is not None:
+        channel_id = get_channel_id_by_name(args.channel)
+        if channel_id is None:
+            print(f"Channel '{args.channel}' could not be found.")
+            sys.exit(1)
+    user_id = None
+    if args.user is not None:
+        user_id = get_user_id_by_username(args.user)
+        if user_id is None:
+            print(f"User '{args.user}' could not be found.")
+            sys.exit(1)
+    earliest = parse_date_(args.since)
+    latest = parse_date_(args.until, days=1)
+    with init_filecache(args.workspace) as filecache:
+        if args.reindex:
+            reindex_messages(filecache)
+        results = search_messages(
+            filecache,
+            args.query,
+            channel_id=channel_id,
+            user_id=user_id,
+            earliest=earliest,
+            latest=latest,
+            limit=args.limit,
+        )
+        current_channel = None
+        try:
+            for result_channel_id, item in results:
+                if result_channel_id != current_channel:
+                    display_channel_banner(result_channel_id)
+                    current_channel = result_channel_id
+                display_message_item(
+                    item,
+                    config,
+                    filecache,
+                    show_thread_id=args.show_thread_id,
+                    no_files=args.no_files,
+                )
+        except sqlite3.OperationalError as ex:
+            print(f"Invalid search query '{args.query}': {ex}", file=sys.stderr)
+            sys.exit(1)
+
+
+def display_channel_banner(channel_id):
+    """
+    Display the channel banner.
+    """
+    channel_info = get_channel_info(channel_id)
+    if channel_info is None:
+        channel_name = channel_id
+    else:
+        channel_name = channel_info.name
+    console.rule(f"[channel]{escape(channel_name)}[/channel]")
+
+
+def parse_date_(date_str, days=0):
+    """
+    Parse a YYYY-MM-DD date and return the timestamp of local midnight on that
+    date, offset by `days`.
+    Returns None if `date_str` is None.
+    """
+    if date_str is None:
+        return None
+    date = datetime.date.fromisoformat(date_str) + datetime.timedelta(days)
+    dt = datetime.datetime.combine(date, datetime.time())
+    return dt.timestamp()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Search locally synced Slack history.")
+    parser.add_argument(
+        "workspace",
+        action="store",
+        help="Slack Workspace",
+    )
+    parser.add_argument(
+        "query",
+        action="store",
+        help="Full-text search query (SQLite FTS5 syntax).",
+    )
+    parser.add_argument(
+        "-c",
+        "--channel",
+        help="Only search messages in CHANNEL.",
+    )
+    parser.add_argument(
+        "-u",
+        "--user",
+        help="Only search messages posted by USER.",
+    )
+    parser.add_argument(
+        "--since",
+        help="Only search messages posted on or after this date (YYYY-MM-DD).",
+    )
+    parser.add_argument(
+        "--until",
+        help="Only search messages posted on or before this date (YYYY-MM-DD).",
+    )
+    parser.add_argument(
+        "-n",
+        "--limit",
+        default=50,
+        type=int,
+        help="Display at most LIMIT of the most recent matches.",
+    )
+    parser.add_argument(
+        "-t",
+        "--show-thread-id",
+        action="store_true",
+        help="Show the thread ID of each post.",
+    )
+    parser.add_argument(
+        "--no-files",
+        action="store_true",
+        help="Only show text messages.  Don't download or display files.",
+    )
+    parser.add_argument(
+        "--reindex",
+        action="store_true",
+        help="Rebuild the full-text index before searching.",
+    )
+    parser.add_argument(
+        "--refresh-directory",
+        action="store_true",
+        help="Refresh the cached channel and user directory from Slack.",
+    )
+    args = parser.parse_args()
+    main(args)
@@ -7,7 +7,8 @@ from rich.table import Table
 
 from slackcli.config import load_config
 from slackcli.console import console
-from slackcli.user import get_all_users, load_users
+from slackcli.directory import load_directory
+from slackcli.user import get_all_users
 
 
 def main(args):
@@ -15,7 +16,7 @@ def main(args):
     The main program entrypoint.
     """
     config = load_config(args.workspace)
-    load_users(config)
+    load_directory(config, args.workspace, refresh=args.refresh_directory)
     table = Table(title="Slack Users")
     table.add_column("ID", style="cyan", no_wrap=True)
     table.add_column("Name", style="blue", no_wrap=True)
@@ -27,12 +28,12 @@ def main(args):
     for user_id, entry in get_all_users():
         table.add_row(
             user_id,
-            entry["name"],
-            str(entry["is_admin"]),
-            str(entry["is_bot"]),
-            str(entry["is_owner"]),
-            str(entry["is_primary_owner"]),
-            str(entry["tz"]),
+            entry.name,
+            str(entry.is_admin),
+            str(entry.is_bot),
+            str(entry.is_owner),
+            str(entry.is_primary_owner),
+            str(entry.tz),
         )
     console.print(table)
 
@@ -44,5 +45,10 @@ if __name__ == "__main__":
         action="store",
         help="Slack Workspace",
     )
+    parser.add_argument(
+        "--refresh-directory",
+        action="store_true",
+        help="Refresh the cached channel and user directory from Slack.",
+    )
     args = parser.parse_args()
     main(args)
@@ -0,0 +1,171 @@
+import atexit
+import contextlib
+import importlib.util
+import threading
+
+import httpx
+from logzero import logger
+from rich import inspect
+
+from slackcli.ratelimit import RequestScheduler
+
+API_URL = "https://slack.com/api/"
+DEFAULT_TIMEOUT = 30.0
+DEFAULT_MAX_CONNECTIONS = 10
+DEFAULT_KEEPALIVE_EXPIRY = 60.0
+
+client_ = None
+client_lock_ = threading.Lock()
+
+
+class SlackClient:
+    """
+    Slack Web API client.
+    Owns a pooled HTTP client so that connections are kept alive and reused
+    across API calls and file downloads, and a scheduler that keeps requests
+    within Slack's rate limits.
+    """
+
+    def __init__(self, config):
+        user_token = config["oauth"]["user_token"]
+        http_cfg = config.get("http", {})
+        timeout = http_cfg.get("timeout", DEFAULT_TIMEOUT)
+        connect_timeout = http_cfg.get("connect_timeout", timeout)
+        max_connections = http_cfg.get("max_connections", DEFAULT_MAX_CONNECTIONS)
+        keepalive_expiry = http_cfg.get("keepalive_expiry", DEFAULT_KEEPALIVE_EXPIRY)
+        http2 = http_cfg.get("http2", True) and http2_available_()
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.http = httpx.Client(
+            base_url=API_URL,
+            headers={"Authorization": f"Bearer {user_token}"},
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            limits=limits,
+            http2=http2,
+        )
+        self.scheduler = RequestScheduler(config)
+
+    def get(self, url, params=None, headers=None):
+        """
+        Issue a GET request for an API method name or an absolute URL.
+        """
+        return self.scheduler.request(
+            get_api_method_(url),
+            lambda: self.http.get(url, params=params, headers=headers),
+        )
+
+    def post(self, url, params=None, headers=None, **kwargs):
+        """
+        Issue a POST request for an API method name or an absolute URL.
+        Requests that upload a file which cannot be rewound, such as a pipe,
+        are not retried.
+        """
+        files = kwargs.get("files", {})
+        retry = all(f.seekable() for f in files.values())
+        positions = {}
+        if retry:
+            positions = {name: f.tell() for name, f in files.items()}
+
+        def send():
+            # Uploads are rewound so that a retried request resends the file.
+            for name, pos in positions.items():
+                files[name].seek(pos)
+            return self.http.post(url, params=params, headers=headers, **kwargs)
+
+        return self.scheduler.request(get_api_method_(url), send, retry=retry)
+
+    @contextlib.contextmanager
+    def stream(self, url, params=None, headers=None):
+        """
+        Issue a streaming GET request for an API method name or an absolute
+        URL.
+        The response body is read incrementally, e.g. with `iter_bytes()`,
+        and the response is closed on exit.
+        """
+
+        def send():
+            request = self.http.build_request(
+                "GET", url, params=params, headers=headers
+            )
+            return self.http.send(request, stream=True)
+
+        response = self.scheduler.request(get_api_method_(url), send)
+        try:
+            yield response
+        finally:
+            response.close()
+
+    def get_stats(self):
+        """
+        Return counters for issued, throttled, rate limited and retried
+        requests.
+        """
+        return self.scheduler.get_stats()
+
+    def close(self):
+        """
+        Log the request counters and close pooled connections.
+        """
+        stats = self.get_stats()
+        logger.debug(
+            f"Slack API requests: {stats['requests']}, throttled:"
+            f" {stats['throttled']}, rate limited: {stats['rate_limited']},"
+            f" retried: {stats['retried']}."
+        )
+        self.http.close()
+
+
+def get_client(config):
+    """
+    Return the shared Slack API client, creating it on first use.
+    """
+    global client_
+    with client_lock_:
+        if client_ is None:
+            client_ = SlackClient(config)
+            atexit.register(client_.close)
+        return client_
+
+
+def get_api_method_(url):
+    """
+    Return the API method name for `url`, or None if `url` is an absolute URL
+    such as a private file download.
+    """
+    if url.startswith("https://") or url.startswith("http://"):
+        return None
+    return url
+
+
+def http2_available_():
+    """
+    Return True if the optional HTTP/2 support for httpx is installed.
+    """
+    return importlib.util.find_spec("h2") is not None
+
+
+def page_results(request_func, url, params, headers=None):
+    """
+    Generator pages results for web API requests.
+    Paging continues while the response reports `has_more` or includes a
+    non-empty `response_metadata.next_cursor`.
+    """
+    orig_params = dict(params)
+    while True:
+        r = request_func(url, params=params, headers=headers)
+        r.raise_for_status()
+        json_response = r.json()
+        yield json_response
+        has_more = json_response.get("has_more", False)
+        response_metadata = json_response.get("response_metadata", {})
+        cursor = response_metadata.get("next_cursor", "")
+        if not has_more and cursor == "":
+            break
+        if cursor == "":
+            inspect(response_metadata)
+            raise KeyError("next_cursor")
+        params = dict(orig_params)
+        params["cursor"] = cursor
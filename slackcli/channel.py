@@ -1,55 +1,164 @@
-import httpx
+from typing import NamedTuple
 
-channel_map_ = None
+from logzero import logger
 
+from slackcli.api import get_client, page_results
 
-def query_channels(config):
+PAGE_LIMIT = 1000
+CHANNEL_TYPES = ("channel", "group", "im", "mpim")
+
+
+class ChannelInfo(NamedTuple):
+    """
+    Directory entry for a channel.
+    """
+
+    name: str
+    is_channel: bool
+    is_group: bool
+    is_im: bool
+    is_mpim: bool
+    is_private: bool
+
+
+class ChannelDirectory(NamedTuple):
+    """
+    Loaded channels along with indexes for looking them up.
+    """
+
+    # Channel ID to ChannelInfo.
+    channels: dict
+    # Lowercase channel name to channel ID.
+    ids_by_name: dict
+    # Channel type to a tuple of channel IDs.
+    ids_by_type: dict
+
+
+class DMInfo(NamedTuple):
+    """
+    Directory entry for a DM or multi-person DM.
+    `user` is the other user in a DM, and `name` the name of a multi-person
+    DM.
+    """
+
+    user: str
+    name: str
+    is_mpim: bool
+
+
+channel_directory_ = ChannelDirectory({}, {}, {})
+# DM channel ID to DMInfo.
+dm_map_ = {}
+
+
+def query_channels(
+    config, exclude_archived=True, types="public_channel,private_channel"
+):
     """
     Generator queries channels and produces entries corresponding to each one.
+    Archived channels are filtered out by Slack unless `exclude_archived` is
+    False.
+    `types` is a comma-separated list of the conversation types to query.
     """
-    url = "https://slack.com/api/conversations.list"
-    user_token = config["oauth"]["user_token"]
-    headers = {"Authorization": f"Bearer {user_token}"}
-    params = {"types": "public_channel,private_channel"}
-    response = httpx.get(url, headers=headers, params=params)
-    json_response = response.json()
-    channels = json_response["channels"]
-    for channel in channels:
-        yield channel
+    client = get_client(config)
+    params = {
+        "types": types,
+        "limit": PAGE_LIMIT,
+        "exclude_archived": str(exclude_archived).lower(),
+    }
+    for json_response in page_results(client.get, "conversations.list", params=params):
+        channels = json_response["channels"]
+        for channel in channels:
+            yield channel
 
 
 def load_dm_info(config, dm_id):
     """
-    Loads and returns DM info for the DM channel identified by `dm_id`.
+    Return the DMInfo for the DM channel identified by `dm_id`.
+    DMs missing from the directory are looked up with the Slack API and
+    remembered.
     """
-    url = "https://slack.com/api/conversations.info"
-    user_token = config["oauth"]["user_token"]
-    headers = {"Authorization": f"Bearer {user_token}"}
+    dm_info = dm_map_.get(dm_id)
+    if dm_info is not None:
+        return dm_info
+    client = get_client(config)
     params = {"channel": dm_id}
-    response = httpx.get(url, headers=headers, params=params)
+    response = client.get("conversations.info", params=params)
     json_response = response.json()
-    return json_response["channel"]
+    dm_info = make_dm_info(json_response["channel"])
+    dm_map_[dm_id] = dm_info
+    return dm_info
 
 
-def load_channels(config):
+def set_dms(dm_map):
     """
-    Get channels.
+    Replace the loaded DMs with `dm_map`, a mapping of channel ID to DMInfo.
     """
-    global channel_map_
-    channel_map_ = {}
+    global dm_map_
+    dm_map_ = dm_map
+
+
+def fetch_dms(config):
+    """
+    Query DMs and multi-person DMs and return a mapping of channel ID to
+    DMInfo.
+    If the token may not list DMs, the DMs found so far are returned and the
+    rest are looked up as needed.
+    """
+    dm_map = {}
+    try:
+        for channel in query_channels(config, types="im,mpim"):
+            dm_map[channel["id"]] = make_dm_info(channel)
+    except KeyError as ex:
+        logger.warning(f"Could not list DMs: {ex}")
+    return dm_map
+
+
+def make_dm_info(fields):
+    """
+    Return a DMInfo from a mapping of field names to values.
+    """
+    return DMInfo(fields.get("user"), fields.get("name"), fields.get("is_mpim", False))
+
+
+def set_channels(channel_map):
+    """
+    Replace the loaded channels with `channel_map`, a mapping of channel ID
+    to ChannelInfo, and index them.
+    """
+    global channel_directory_
+    ids_by_name = {}
+    ids_by_type = {channel_type: [] for channel_type in CHANNEL_TYPES}
+    for channel_id, channel_info in channel_map.items():
+        ids_by_name.setdefault(channel_info.name.lower(), channel_id)
+        for channel_type in CHANNEL_TYPES:
+            if getattr(channel_info, f"is_{channel_type}"):
+                ids_by_type[channel_type].append(channel_id)
+    ids_by_type = {
+        channel_type: tuple(channel_ids)
+        for channel_type, channel_ids in ids_by_type.items()
+    }
+    # Replace the whole directory at once so lookups from other threads
+    # never see a partially indexed directory.
+    channel_directory_ = ChannelDirectory(channel_map, ids_by_name, ids_by_type)
+
+
+def fetch_channels(config):
+    """
+    Query channels and return a mapping of channel ID to ChannelInfo.
+    """
+    channel_map = {}
     for channel in query_channels(config):
         channel_id = channel["id"]
-        channel_info = {}
-        is_archived = channel["is_archived"]
-        if is_archived:
-            continue
-        channel_info["name"] = channel["name"]
-        channel_info["is_channel"] = channel["is_channel"]
-        channel_info["is_group"] = channel["is_group"]
-        channel_info["is_im"] = channel["is_im"]
-        channel_info["is_mpim"] = channel["is_mpim"]
-        channel_info["is_private"] = channel["is_private"]
-        channel_map_[channel_id] = channel_info
+        channel_map[channel_id] = make_channel_info(channel)
+    return channel_map
+
+
+def make_channel_info(fields):
+    """
+    Return a ChannelInfo from a mapping of field names to values.
+    """
+    return ChannelInfo(*(fields[field] for field in ChannelInfo._fields))
 
 
 def get_channel_info(channel_id):
@@ -57,45 +166,27 @@ def get_channel_info(channel_id):
     Get channel info by channel ID.
     Returns None if channel ID cannot be determined.
     """
-    global channel_map_
-    return channel_map_[channel_id]
+    return channel_directory_.channels.get(channel_id)
 
 
 def get_channel_id_by_name(name):
     """
-    Return the channel ID of the channel that matches `name`.
+    Return the channel ID of the channel that matches `name`, ignoring case.
     """
-    global channel_map_
-    search_term = name.lower()
-    for channel_id, info in channel_map_.items():
-        channel_name = info["name"].lower()
-        if channel_name == search_term:
-            return channel_id
-    return None
+    return channel_directory_.ids_by_name.get(name.lower())
 
 
 def get_all_channel_ids():
     """
     Return a frozenset of all channel IDs.
     """
-    return frozenset(channel_map_.keys())
+    return frozenset(channel_directory_.channels.keys())
 
 
 def get_channels_by_type(channel_type):
     """
     Generator produces tuples of (channel_id, channel_name).
     """
-    global channel_map_
-    for channel_id, channel_info in channel_map_.items():
-        is_channel = channel_info["is_channel"]
-        is_group = channel_info["is_group"]
-        is_im = channel_info["is_im"]
-        is_mpim = channel_info["is_mpim"]
-        if channel_type == "channel" and is_channel:
-            yield (channel_id, channel_info["name"])
-        elif channel_type == "group" and is_group:
-            yield (channel_id, channel_info["name"])
-        elif channel_type == "im" and is_im:
-            yield (channel_id, channel_info["name"])
-        elif channel_type == "mpim" and is_mpim:
-            yield (channel_id, channel_info["name"])
+    directory = channel_directory_
+    for channel_id in directory.ids_by_type.get(channel_type, ()):
+        yield (channel_id, directory.channels[channel_id].name)
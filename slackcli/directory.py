@@ -0,0 +1,182 @@
+import datetime
+import json
+import threading
+
+from logzero import logger
+
+from slackcli.channel import (
+    fetch_channels,
+    fetch_dms,
+    make_channel_info,
+    make_dm_info,
+    set_channels,
+    set_dms,
+)
+from slackcli.filecache import init_filecache
+from slackcli.user import fetch_users, make_user_info, set_users
+
+DEFAULT_TTL = 3600
+
+# Functions to fetch, set, and construct the entries of each kind.
+directory_kinds_ = {
+    "channel": (fetch_channels, set_channels, make_channel_info),
+    "dm": (fetch_dms, set_dms, make_dm_info),
+    "user": (fetch_users, set_users, make_user_info),
+}
+
+
+def load_directory(config, workspace, refresh=False):
+    """
+    Load the channel and user directory for `workspace`.
+
+    Entries cached in the workspace DB are used without making any API calls.
+    Entries older than the configured TTL are used as-is and revalidated in a
+    background thread.  Missing entries are fetched from the Slack API, as
+    are all entries when `refresh` is True.
+    """
+    ttl = get_directory_ttl(config)
+    now = datetime.datetime.today().timestamp()
+    stale_kinds = []
+    with init_filecache(workspace) as db:
+        create_tables_(db)
+        for kind, (fetch_func, set_func, _) in directory_kinds_.items():
+            refreshed = get_refreshed_(db, kind)
+            if refresh or refreshed is None:
+                entries = fetch_func(config)
+                store_entries_(db, kind, entries)
+            else:
+                entries = load_entries_(db, kind)
+                if now - refreshed > ttl:
+                    stale_kinds.append(kind)
+            set_func(entries)
+    if len(stale_kinds) > 0:
+        start_revalidation_thread_(config, workspace, stale_kinds)
+
+
+def get_directory_ttl(config):
+    """
+    Return the directory cache TTL in seconds.
+    """
+    directory_cfg = config.get("directory", {})
+    return directory_cfg.get("ttl", DEFAULT_TTL)
+
+
+def create_tables_(db):
+    """
+    Create directory cache tables.
+    """
+    cur = db.cursor()
+    sql = """\
+          CREATE TABLE IF NOT EXISTS directory(kind TEXT, entry_id TEXT,
+            info TEXT, PRIMARY KEY (kind, entry_id))
+          """
+    cur.execute(sql)
+    sql = """\
+          CREATE TABLE IF NOT EXISTS directory_meta(kind TEXT PRIMARY KEY,
+            refreshed NUMERIC)
+          """
+    cur.execute(sql)
+    db.commit()
+
+
+def get_refreshed_(db, kind):
+    """
+    Return the timestamp at which directory entries of type `kind` were last
+    refreshed, or None if they have never been cached.
+    """
+    cur = db.cursor()
+    sql = """\
+          SELECT refreshed
+          FROM directory_meta
+          WHERE kind = ?
+          """
+    cur.execute(sql, [kind])
+    row = cur.fetchone()
+    if row is None:
+        return None
+    return row[0]
+
+
+def load_entries_(db, kind):
+    """
+    Return a mapping of entry ID to info for cached entries of type `kind`.
+    """
+    _, _, make_func = directory_kinds_[kind]
+    cur = db.cursor()
+    sql = """\
+          SELECT entry_id,
+                 info
+          FROM directory
+          WHERE kind = ?
+          """
+    cur.execute(sql, [kind])
+    return {entry_id: make_func(json.loads(info)) for entry_id, info in cur.fetchall()}
+
+
+def store_entries_(db, kind, entries):
+    """
+    Store directory entries of type `kind` in the cache.
+    Only entries that were added, changed, or removed since the last refresh
+    are written.
+    """
+    cur = db.cursor()
+    sql = """\
+          SELECT entry_id,
+                 info
+          FROM directory
+          WHERE kind = ?
+          """
+    cur.execute(sql, [kind])
+    cached = dict(cur.fetchall())
+    changed = []
+    for entry_id, info in entries.items():
+        serialized = json.dumps(info._asdict(), sort_keys=True)
+        if cached.pop(entry_id, None) != serialized:
+            changed.append((kind, entry_id, serialized))
+    removed = [(kind, entry_id) for entry_id in cached.keys()]
+    sql = """\
+          REPLACE INTO directory(kind, entry_id, info)
+          VALUES (?, ?, ?)
+          """
+    cur.executemany(sql, changed)
+    sql = """\
+          DELETE FROM directory
+          WHERE kind = ? AND entry_id = ?
+          """
+    cur.executemany(sql, removed)
+    refreshed = datetime.datetime.today().timestamp()
+    sql = """\
+          REPLACE INTO directory_meta(kind, refreshed)
+          VALUES (?, ?)
+          """
+    cur.execute(sql, [kind, refreshed])
+    db.commit()
+
+
+def start_revalidation_thread_(config, workspace, kinds):
+    """
+    Start a thread that refreshes the stale directory entries of each type in
+    `kinds`.
+    The thread is a daemon so a short-lived CLI doesn't wait for the refresh
+    before it exits.  Each kind is committed on its own, so an interrupted
+    refresh leaves the remaining kinds stale until the next run.
+    """
+    threading.Thread(
+        target=revalidate_directory_, daemon=True, args=(config, workspace, kinds)
+    ).start()
+
+
+def revalidate_directory_(config, workspace, kinds):
+    """
+    Refresh stale directory entries from the Slack API.
+    On failure the stale entries remain in use.
+    """
+    try:
+        with init_filecache(workspace) as db:
+            for kind in kinds:
+                fetch_func, set_func, _ = directory_kinds_[kind]
+                entries = fetch_func(config)
+                store_entries_(db, kind, entries)
+                set_func(entries)
+    except Exception as ex:
+        logger.warning(f"Could not revalidate the directory cache: {ex}")
@@ -0,0 +1,122 @@
+import queue
+
+OVERFLOW_POLICIES = ("block", "drop-oldest", "collapse")
+DEFAULT_MAX_SIZE = 1000
+DEFAULT_OVERFLOW_POLICY = "collapse"
+
+
+class EventQueue(queue.Queue):
+    """
+    Bounded queue of listener tasks.
+
+    Tasks are `(task_type, data)` pairs.  When the queue is full, what happens
+    to a new "display" task depends on the overflow policy:
+
+    block
+        The producer waits until there is room.  In the listener the
+        producer is the Socket Mode event handler, so waiting delays the
+        acknowledgement of the event and Slack may redeliver it.
+    drop-oldest
+        The oldest queued display task is discarded to make room.
+    collapse
+        The task is discarded and counted.  A single "collapsed" task per
+        channel reports how many messages were skipped, so the queue never
+        holds more than `maxsize` tasks plus one per channel.  This is the
+        default.
+
+    Other tasks, such as rendered images, are always queued without waiting
+    because the display workers depend on them being delivered.
+    """
+
+    def __init__(self, maxsize=DEFAULT_MAX_SIZE, policy=DEFAULT_OVERFLOW_POLICY):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown queue overflow policy '{policy}'.")
+        super().__init__(maxsize)
+        self.policy = policy
+        self.collapsed = {}
+        self.stats = {"high_water": 0, "dropped": 0, "collapsed": 0}
+
+    def put(self, item, block=True, timeout=None):
+        """
+        Queue a task, applying the overflow policy if the queue is full.
+        """
+        task_type, data = item
+        if task_type == "display" and self.policy == "block":
+            super().put(item, block, timeout)
+            with self.mutex:
+                self.update_high_water_()
+            return
+        with self.not_full:
+            if task_type == "display" and self.is_full_():
+                if self.policy == "drop-oldest":
+                    self.drop_oldest_()
+                else:
+                    self.collapse_(data[0])
+                    return
+            self.put_task_(item)
+
+    def get_stats(self):
+        """
+        Return the current depth along with copies of the queue counters.
+        """
+        with self.mutex:
+            stats = dict(self.stats)
+            stats["depth"] = self._qsize()
+        return stats
+
+    def _get(self):
+        task_type, data = super()._get()
+        if task_type == "collapsed":
+            count = self.collapsed.pop(data)
+            return task_type, (data, count)
+        return task_type, data
+
+    def is_full_(self):
+        """
+        Return True if there is no room for another task.
+        The caller must hold the queue mutex.
+        """
+        return 0 < self.maxsize <= self._qsize()
+
+    def put_task_(self, item):
+        """
+        Queue a task.
+        The caller must hold the queue mutex.
+        """
+        self._put(item)
+        self.unfinished_tasks += 1
+        self.not_empty.notify()
+        self.update_high_water_()
+
+    def drop_oldest_(self):
+        """
+        Discard the oldest queued display task.
+        The caller must hold the queue mutex.
+        """
+        for index, (task_type, data) in enumerate(self.queue):
+            if task_type == "display":
+                del self.queue[index]
+                self.unfinished_tasks -= 1
+                self.stats["dropped"] += 1
+                return
+
+    def collapse_(self, channel_id):
+        """
+        Count a display task for the channel that did not fit in the queue.
+        The caller must hold the queue mutex.
+        """
+        self.stats["collapsed"] += 1
+        if channel_id in self.collapsed:
+            self.collapsed[channel_id] += 1
+            return
+        self.collapsed[channel_id] = 1
+        self.put_task_(("collapsed", channel_id))
+
+    def update_high_water_(self):
+        """
+        Record the deepest the queue has been.
+        The caller must hold the queue mutex.
+        """
+        depth = self._qsize()
+        if depth > self.stats["high_water"]:
+            self.stats["high_water"] = depth
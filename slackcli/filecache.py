@@ -1,27 +1,92 @@
 import datetime
+import hashlib
+import os
 import pathlib
 import sqlite3
+import tempfile
+import threading
 from contextlib import contextmanager
-from io import BytesIO
 
-import httpx
 from rich import inspect
 
+from slackcli.api import get_client
+
+CHUNK_SIZE = 64 * 1024
+# Version of the file cache schema, stored in the DB's user_version.
+SCHEMA_VERSION = 1
+DEFAULT_MAX_BYTES = 1024**3
+EVICTION_POLICIES = ("lru", "lfu")
+
+# File metadata needed to validate the cache and download a file.
+file_metadata_fields_ = ("created", "name", "mimetype", "url_private")
+
+# Lock and number of holders or waiters for each file being downloaded, so a
+# file is only downloaded by one thread at a time.
+download_locks_ = {}
+download_locks_lock_ = threading.Lock()
+
+# Columns added to the `files` table after its initial version.
+added_columns_ = [
+    ("sha256", "TEXT"),
+    ("size", "INTEGER"),
+    ("last_accessed", "NUMERIC"),
+    ("access_count", "INTEGER DEFAULT 0"),
+]
+
 
 @contextmanager
 def init_filecache(workspace):
     """
     Make sure file cache has been initialized for this workspace.
     """
-    cache_file = pathlib.Path(f"~/.slackcli/{workspace}.db").expanduser()
-    with sqlite3.connect(cache_file) as db:
-        create_tables_(db)
+    with open_filecache(workspace) as db:
         yield db
 
 
+def open_filecache(workspace):
+    """
+    Open and return a connection to the file cache for this workspace.
+    Each thread that uses the file cache needs its own connection.
+    """
+    cache_file = pathlib.Path(f"~/.slackcli/{workspace}.db").expanduser()
+    db = sqlite3.connect(cache_file)
+    db.execute("PRAGMA journal_mode=WAL")
+    create_tables_(db)
+    return db
+
+
 def create_tables_(db):
     """
-    Create file cache tables.
+    Create file cache tables and migrate them from older versions.
+    This only does work the first time a DB is opened at a new schema
+    version.  The upgrade runs in a single transaction, so connections
+    opened concurrently by other threads wait for it instead of repeating it.
+    """
+    if get_schema_version_(db) >= SCHEMA_VERSION:
+        return
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        if get_schema_version_(db) < SCHEMA_VERSION:
+            upgrade_tables_(db)
+            db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+
+def get_schema_version_(db):
+    """
+    Return the file cache schema version of the DB.
+    """
+    (version,) = db.execute("PRAGMA user_version").fetchone()
+    return version
+
+
+def upgrade_tables_(db):
+    """
+    Create or upgrade the file cache tables.
+    The caller is responsible for committing.
     """
     cur = db.cursor()
     sql = """\
@@ -29,7 +94,114 @@ def create_tables_(db):
             cached NUMERIC, name TEXT, mimetype TEXT, title TEXT, file_data BLOB)
           """
     cur.execute(sql)
-    db.commit()
+    cur.execute("PRAGMA table_info(files)")
+    columns = set(row[1] for row in cur.fetchall())
+    for column, column_type in added_columns_:
+        if column not in columns:
+            cur.execute(f"ALTER TABLE files ADD COLUMN {column} {column_type}")
+    sql = """\
+          CREATE TABLE IF NOT EXISTS cache_counters(name TEXT PRIMARY KEY,
+            value INTEGER)
+          """
+    cur.execute(sql)
+    migrate_file_data_(db)
+
+
+def migrate_file_data_(db):
+    """
+    Move file data stored in the `file_data` column by older versions into
+    blob storage.
+    The space freed in the DB is reused for new rows; `slack_file.py prune
+    --vacuum` returns it to the file system.
+    The caller is responsible for committing.
+    """
+    cur = db.cursor()
+    sql = """\
+          SELECT file_id
+          FROM files
+          WHERE file_data IS NOT NULL
+          """
+    cur.execute(sql)
+    file_ids = [row[0] for row in cur.fetchall()]
+    if len(file_ids) == 0:
+        return
+    for file_id in file_ids:
+        sql = """\
+              SELECT file_data
+              FROM files
+              WHERE file_id = ?
+              """
+        cur.execute(sql, [file_id])
+        (file_data,) = cur.fetchone()
+        sha256 = hashlib.sha256(file_data).hexdigest()
+        write_blob_(db, sha256, file_data)
+        sql = """\
+              UPDATE files
+              SET file_data = NULL,
+                  sha256 = ?,
+                  size = ?
+              WHERE file_id = ?
+              """
+        cur.execute(sql, [sha256, len(file_data), file_id])
+
+
+def get_blob_dir_(db):
+    """
+    Return the directory where file data for the cache `db` is stored.
+    """
+    cur = db.cursor()
+    cur.execute("PRAGMA database_list")
+    for _, name, db_file in cur.fetchall():
+        if name == "main":
+            return pathlib.Path(db_file).with_suffix(".files")
+
+
+def get_blob_path_(db, sha256):
+    """
+    Return the path of the blob with content hash `sha256`.
+    """
+    return get_blob_dir_(db) / sha256[:2] / sha256
+
+
+def write_blob_(db, sha256, binary_data):
+    """
+    Store `binary_data` as the blob with content hash `sha256`, unless that
+    blob is already stored.
+    """
+    blob_path = get_blob_path_(db, sha256)
+    if blob_path.exists():
+        return
+    blob_path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=blob_path.parent)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(binary_data)
+        os.replace(tmp_path, blob_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def remove_unreferenced_blob_(db, sha256):
+    """
+    Remove the blob with content hash `sha256` if no cached file refers to it.
+    Returns True if the blob was removed.
+    """
+    if sha256 is None:
+        return False
+    cur = db.cursor()
+    sql = """\
+          SELECT COUNT(*)
+          FROM files
+          WHERE sha256 = ?
+          """
+    cur.execute(sql, [sha256])
+    (count,) = cur.fetchone()
+    if count > 0:
+        return False
+    blob_path = get_blob_path_(db, sha256)
+    blob_path.unlink(missing_ok=True)
+    return True
 
 
 def get_file_info(db, earliest=None, latest=None):
@@ -56,26 +228,38 @@ def get_file_info(db, earliest=None, latest=None):
             break
 
 
-def insert_file_in_cache(db, file_id, binary_data, name, mimetype, title=None):
+def record_file_in_cache_(db, file_id, sha256, size, name, mimetype, title=None):
     """
-    Inserts the file into the cache.
+    Record that the file ID refers to the stored blob with content hash
+    `sha256`.
+    Returns an open binary file handle for the file data.
     """
     if title is None:
         title = name
     cached = datetime.datetime.today().timestamp()
+    cur = db.cursor()
     sql = """\
-          REPLACE INTO files(file_id, cached, name, mimetype, title, file_data)
-          VALUES (?, ?, ?, ?, ?, ?)
+          SELECT sha256
+          FROM files
+          WHERE file_id = ?
           """
-    cur = db.cursor()
-    cur.execute(sql, [file_id, cached, name, mimetype, title, binary_data])
+    cur.execute(sql, [file_id])
+    row = cur.fetchone()
+    sql = """\
+          REPLACE INTO files(file_id, cached, name, mimetype, title, sha256, size,
+            last_accessed, access_count)
+          VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+          """
+    cur.execute(sql, [file_id, cached, name, mimetype, title, sha256, size, cached, 1])
     db.commit()
-    return BytesIO(binary_data)
+    if row is not None and row[0] != sha256:
+        remove_unreferenced_blob_(db, row[0])
+    return open(get_blob_path_(db, sha256), "rb")
 
 
 def get_file_from_cache(db, file_id, timestamp=None):
     """
-    Return file data for the file ID in the cache.
+    Return an open binary file handle for the file ID in the cache.
     If ``timestamp`` is provided, only return file data that matches the
     timestamp or is more recent.
     Returns None if no file data is cached.
@@ -83,54 +267,253 @@ def get_file_from_cache(db, file_id, timestamp=None):
     cur = db.cursor()
     sql = """\
           SELECT cached,
-                 file_data
+                 sha256
           FROM files
           WHERE file_id = ?
           """
     cur.execute(sql, [file_id])
     row = cur.fetchone()
     if row is None:
+        increment_counter_(db, "misses")
         return None
-    cached, file_data = row
+    cached, sha256 = row
     if timestamp is not None:
         if cached < timestamp:
+            increment_counter_(db, "misses")
             return None
-    return BytesIO(file_data)
+    try:
+        file_data = open(get_blob_path_(db, sha256), "rb")
+    except FileNotFoundError:
+        increment_counter_(db, "misses")
+        return None
+    last_accessed = datetime.datetime.today().timestamp()
+    sql = """\
+          UPDATE files
+          SET last_accessed = ?,
+              access_count = access_count + 1
+          WHERE file_id = ?
+          """
+    cur.execute(sql, [last_accessed, file_id])
+    increment_counter_(db, "hits")
+    return file_data
+
+
+def increment_counter_(db, name):
+    """
+    Increment the cache counter `name` and commit.
+    """
+    sql = """\
+          INSERT INTO cache_counters(name, value)
+          VALUES (?, 1)
+          ON CONFLICT(name) DO UPDATE SET value = value + 1
+          """
+    db.execute(sql, [name])
+    db.commit()
+
+
+def get_cache_stats(db):
+    """
+    Return a dict of file cache statistics: the number of cached files and of
+    distinct stored blobs, the bytes used by the blobs, and the number of
+    cache hits and misses.
+    """
+    cur = db.cursor()
+    sql = """\
+          SELECT COUNT(*)
+          FROM files
+          """
+    cur.execute(sql)
+    (file_count,) = cur.fetchone()
+    sql = """\
+          SELECT COUNT(*),
+                 COALESCE(SUM(size), 0)
+          FROM (SELECT MAX(size) AS size
+                FROM files
+                GROUP BY sha256)
+          """
+    cur.execute(sql)
+    blob_count, total_bytes = cur.fetchone()
+    stats = {
+        "files": file_count,
+        "blobs": blob_count,
+        "bytes": total_bytes,
+        "hits": 0,
+        "misses": 0,
+    }
+    sql = """\
+          SELECT name,
+                 value
+          FROM cache_counters
+          """
+    cur.execute(sql)
+    for name, value in cur.fetchall():
+        stats[name] = value
+    return stats
+
+
+def get_cache_budget(config):
+    """
+    Return (max_bytes, policy) for the file cache.
+    """
+    filecache_cfg = config.get("filecache", {})
+    max_bytes = filecache_cfg.get("max_bytes", DEFAULT_MAX_BYTES)
+    policy = filecache_cfg.get("eviction_policy", "lru")
+    if policy not in EVICTION_POLICIES:
+        policy = "lru"
+    return max_bytes, policy
+
+
+def prune_cache(db, max_bytes, policy="lru", keep=None):
+    """
+    Evict cached files until the stored blobs use no more than `max_bytes`.
+    With the "lru" policy the least recently accessed files are evicted
+    first.  With the "lfu" policy the least frequently accessed files are
+    evicted first.  The file ID `keep` is never evicted.
+    Returns the number of files evicted.
+    """
+    total_bytes = get_cache_stats(db)["bytes"]
+    if total_bytes <= max_bytes:
+        return 0
+    if policy == "lfu":
+        order = "access_count, last_accessed"
+    else:
+        order = "last_accessed"
+    cur = db.cursor()
+    sql = f"""\
+          SELECT file_id,
+                 sha256,
+                 size
+          FROM files
+          ORDER BY {order}
+          """
+    cur.execute(sql)
+    candidates = cur.fetchall()
+    evicted = 0
+    for file_id, sha256, size in candidates:
+        if total_bytes <= max_bytes:
+            break
+        if file_id == keep:
+            continue
+        cur.execute("DELETE FROM files WHERE file_id = ?", [file_id])
+        db.commit()
+        evicted += 1
+        if remove_unreferenced_blob_(db, sha256):
+            total_bytes -= size or 0
+    return evicted
 
 
 def get_file(db, config, file_info):
     """
-    Return binary file data or None if file cannot be retrieved.
+    Return an open binary file handle for the file data, or None if the file
+    cannot be retrieved.
+    The file metadata included in the message is used to validate the cache
+    when it is complete, so a cache hit makes no API calls.  Otherwise the
+    metadata is looked up with `files.info`.
     """
-    user_token = config["oauth"]["user_token"]
     file_id = file_info["id"]
     is_tombstone = file_info.get("mode") == "tombstone"
     if is_tombstone:
         return get_file_from_cache(db, file_id)
-    params = {"file": file_id}
-    headers = {"Authorization": f"Bearer {user_token}"}
-    url = "https://slack.com/api/files.info"
-    r = httpx.get(url, params=params, headers=headers)
-    if r.status_code != 200:
-        return get_file_from_cache(db, file_id)
-    json_response = r.json()
-    try:
-        file_metadata = json_response["file"]
-    except KeyError:
-        inspect(json_response)
-        raise
+    client = get_client(config)
+    if all(field in file_info for field in file_metadata_fields_):
+        file_metadata = file_info
+    else:
+        params = {"file": file_id}
+        r = client.get("files.info", params=params)
+        if r.status_code != 200:
+            return get_file_from_cache(db, file_id)
+        json_response = r.json()
+        try:
+            file_metadata = json_response["file"]
+        except KeyError:
+            inspect(json_response)
+            raise
     timestamp = file_metadata["created"]
-    file_data = get_file_from_cache(db, file_id, timestamp=timestamp)
-    if file_data is not None:
-        return file_data
-    private_url = file_metadata["url_private"]
-    r = httpx.get(private_url, headers=headers)
-    if r.status_code != 200:
-        return None
-    name = file_metadata["name"]
-    mimetype = file_metadata["mimetype"]
-    title = file_metadata.get("title")
-    file_data = insert_file_in_cache(
-        db, file_id, r.content, name, mimetype, title=title
-    )
+    with lock_download_(file_id):
+        # Another thread may have downloaded the file while this one waited.
+        file_data = get_file_from_cache(db, file_id, timestamp=timestamp)
+        if file_data is not None:
+            return file_data
+        private_url = file_metadata["url_private"]
+        result = download_file_(db, client, file_id, private_url)
+        if result is None:
+            return None
+        sha256, size = result
+        name = file_metadata["name"]
+        mimetype = file_metadata["mimetype"]
+        title = file_metadata.get("title")
+        file_data = record_file_in_cache_(
+            db, file_id, sha256, size, name, mimetype, title=title
+        )
+    max_bytes, policy = get_cache_budget(config)
+    prune_cache(db, max_bytes, policy=policy, keep=file_id)
     return file_data
+
+
+@contextmanager
+def lock_download_(file_id):
+    """
+    Context manager holds the download lock for the file specified by file
+    ID.
+    """
+    with download_locks_lock_:
+        entry = download_locks_.setdefault(file_id, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with download_locks_lock_:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del download_locks_[file_id]
+
+
+def download_file_(db, client, file_id, url):
+    """
+    Stream the file at `url` into blob storage in chunks, hashing it as it is
+    written.
+    A partial download left by an interrupted transfer is resumed with an
+    HTTP Range request.
+    The caller must hold the download lock for the file.
+    Returns (sha256, size), or None if the file cannot be downloaded.
+    """
+    part_path = get_blob_dir_(db) / "partial" / f"{file_id}.part"
+    part_path.parent.mkdir(parents=True, exist_ok=True)
+    hasher = hashlib.sha256()
+    size = 0
+    headers = {}
+    if part_path.exists():
+        with open(part_path, "rb") as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if chunk == b"":
+                    break
+                hasher.update(chunk)
+                size += len(chunk)
+        headers["Range"] = f"bytes={size}-"
+    with client.stream(url, headers=headers) as r:
+        if r.status_code == 206:
+            mode = "ab"
+        elif r.status_code == 200:
+            mode = "wb"
+            hasher = hashlib.sha256()
+            size = 0
+        else:
+            if r.status_code == 416:
+                # The partial download cannot be resumed; start over next time.
+                part_path.unlink(missing_ok=True)
+            return None
+        with open(part_path, mode) as f:
+            for chunk in r.iter_bytes(CHUNK_SIZE):
+                f.write(chunk)
+                hasher.update(chunk)
+                size += len(chunk)
+    sha256 = hasher.hexdigest()
+    blob_path = get_blob_path_(db, sha256)
+    if blob_path.exists():
+        part_path.unlink(missing_ok=True)
+    else:
+        blob_path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(part_path, blob_path)
+    return sha256, size
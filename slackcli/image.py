@@ -1,65 +1,213 @@
+import collections
 import contextlib
+import datetime
+import functools
+import hashlib
+import io
+import os
+import sqlite3
 import tempfile
+import threading
 
 import chafa
 from chafa.loader import Loader
 
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
 image_types = frozenset(["image/jpeg", "image/png", "image/gif"])
 
+FONT_HEIGHT = 24
+FONT_WIDTH = 11
+CANVAS_HEIGHT = 40
+CANVAS_WIDTH = 40
+RENDER_CACHE_SIZE = 256
+PERSISTED_RENDER_LIMIT = 1000
+
+render_cache_ = collections.OrderedDict()
+render_cache_lock_ = threading.Lock()
 
-def display_image(file_data):
+
+def render_image(file_data, db=None):
     """
-    Display an image.
+    Render an image and return the terminal output.
+    Rendered output is cached in memory and, if `db` is given, in the
+    workspace DB, so repeated images are not decoded again.
     """
-    FONT_HEIGHT = 24
-    FONT_WIDTH = 11
-    with write_image_data_to_temp_file_(file_data) as f:
-        image_path = f.name
-        # Load image
-        image = Loader(image_path)
+    binary_data = file_data.read()
     # Create config
     config = chafa.CanvasConfig()
     # Detect pixel mode to use.
     configure_pixel_mode_(config)
+    render_key = make_render_key_(binary_data, config)
+    output = get_cached_render_(render_key, db)
+    if output is not None:
+        return output
+    # Load image
+    pixel_type, pixels, width, height, rowstride = load_image_(binary_data)
     # Set geometry
-    config.height = 40
-    config.width = 40
-    config.calc_canvas_geometry(image.width, image.height, FONT_WIDTH / FONT_HEIGHT)
+    config.height = CANVAS_HEIGHT
+    config.width = CANVAS_WIDTH
+    config.calc_canvas_geometry(width, height, FONT_WIDTH / FONT_HEIGHT)
     config.cell_width = FONT_WIDTH
     config.cell_height = FONT_HEIGHT
     # Configure the canvas.
     canvas = chafa.Canvas(config)
     # Produce the image output.
-    canvas.draw_all_pixels(
-        image.pixel_type, image.get_pixels(), image.width, image.height, image.rowstride
+    canvas.draw_all_pixels(pixel_type, pixels, width, height, rowstride)
+    output = canvas.print(fallback=True).decode()
+    cache_render_(render_key, output, db)
+    return output
+
+
+def load_image_(binary_data):
+    """
+    Decode image data.
+    Returns (pixel_type, pixels, width, height, rowstride).
+    Images are decoded in memory with Pillow when it is installed.  Otherwise
+    they are written to a temporary file for the chafa loader.
+    """
+    if Image is None:
+        with write_image_data_to_temp_file_(binary_data) as f:
+            image = Loader(f.name)
+        return (
+            image.pixel_type,
+            image.get_pixels(),
+            image.width,
+            image.height,
+            image.rowstride,
+        )
+    with Image.open(io.BytesIO(binary_data)) as image:
+        rgba = image.convert("RGBA")
+    width, height = rgba.size
+    return (
+        chafa.PixelType.CHAFA_PIXEL_RGBA8_UNASSOCIATED,
+        rgba.tobytes(),
+        width,
+        height,
+        width * 4,
     )
-    output = canvas.print(fallback=True)
-    print(output.decode())
+
+
+def make_render_key_(binary_data, config):
+    """
+    Return the key for the rendered output of `binary_data` on a canvas
+    configured by `config`.
+    """
+    content_hash = hashlib.sha256(binary_data).hexdigest()
+    term = os.environ.get("TERM", "")
+    return ":".join(
+        [
+            content_hash,
+            f"{CANVAS_WIDTH}x{CANVAS_HEIGHT}",
+            str(config.pixel_mode),
+            str(config.canvas_mode),
+            term,
+        ]
+    )
+
+
+def get_cached_render_(render_key, db=None):
+    """
+    Return cached rendered output for `render_key`, or None if it has not
+    been cached.
+    """
+    with render_cache_lock_:
+        output = render_cache_.get(render_key)
+        if output is not None:
+            render_cache_.move_to_end(render_key)
+            return output
+    if db is None:
+        return None
+    sql = """\
+          SELECT output
+          FROM rendered_images
+          WHERE render_key = ?
+          """
+    try:
+        row = db.execute(sql, [render_key]).fetchone()
+    except sqlite3.OperationalError:
+        # The table has not been created yet.
+        return None
+    if row is None:
+        return None
+    output = row[0]
+    remember_render_(render_key, output)
+    return output
+
+
+def cache_render_(render_key, output, db=None):
+    """
+    Cache rendered output in memory and, if `db` is given, in the workspace
+    DB.
+    Only the most recently rendered images are kept in either cache.
+    """
+    remember_render_(render_key, output)
+    if db is None:
+        return
+    cur = db.cursor()
+    sql = """\
+          CREATE TABLE IF NOT EXISTS rendered_images(render_key TEXT PRIMARY KEY,
+            created NUMERIC, output TEXT)
+          """
+    cur.execute(sql)
+    created = datetime.datetime.today().timestamp()
+    sql = """\
+          REPLACE INTO rendered_images(render_key, created, output)
+          VALUES (?, ?, ?)
+          """
+    cur.execute(sql, [render_key, created, output])
+    sql = """\
+          DELETE FROM rendered_images
+          WHERE render_key NOT IN (SELECT render_key
+                                   FROM rendered_images
+                                   ORDER BY created DESC
+                                   LIMIT ?)
+          """
+    cur.execute(sql, [PERSISTED_RENDER_LIMIT])
+    db.commit()
+
+
+def remember_render_(render_key, output):
+    """
+    Add rendered output to the in-memory LRU cache.
+    """
+    with render_cache_lock_:
+        render_cache_[render_key] = output
+        render_cache_.move_to_end(render_key)
+        while len(render_cache_) > RENDER_CACHE_SIZE:
+            render_cache_.popitem(last=False)
 
 
 def configure_pixel_mode_(config):
     """
     Configure pixel mode.
     """
+    pixel_mode, canvas_mode = detect_term_caps_()
+    config.pixel_mode = pixel_mode
+    config.canvas_mode = canvas_mode
+
+
+@functools.lru_cache(maxsize=None)
+def detect_term_caps_():
+    """
+    Detect the terminal's capabilities once per process.
+    Returns (pixel_mode, canvas_mode).
+    """
     db = chafa.TermDb()
     terminfo = db.detect()
     term_caps = terminfo.detect_capabilities()
-    config.pixel_mode = term_caps.pixel_mode
-    config.canvas_mode = term_caps.canvas_mode
+    return term_caps.pixel_mode, term_caps.canvas_mode
 
 
 @contextlib.contextmanager
-def write_image_data_to_temp_file_(file_data):
+def write_image_data_to_temp_file_(binary_data):
     """
     Writes image data to temporary file.
     """
-    chunk_size = 1024
     with tempfile.NamedTemporaryFile(delete=True) as f:
-        # temp_name = f.name
-        while True:
-            data = file_data.read(chunk_size)
-            if data == b"":
-                break
-            f.write(data)
+        f.write(binary_data)
         f.flush()
         yield f
@@ -1,4 +1,5 @@
 import datetime
+import functools
 
 from rich import inspect
 from rich.markup import escape
@@ -6,15 +7,30 @@ from rich.markup import escape
 from slackcli.channel import get_channel_info
 from slackcli.console import console
 from slackcli.filecache import get_file
-from slackcli.image import display_image, image_types
+from slackcli.image import image_types, render_image
+from slackcli.output import ConsoleWriter
 from slackcli.user import get_user_info
 
 
-def display_message_item(item, config, filecache, show_thread_id=False, no_files=False):
+def display_message_item(
+    item,
+    config,
+    filecache,
+    show_thread_id=False,
+    no_files=False,
+    image_handler=None,
+    writer=None,
+):
     """
     Display a history item.
+    If `image_handler` is given, it is called with the item and the file info
+    of each attached image instead of downloading and displaying the image.
+    Output goes to `writer`, which defaults to writing to the console as each
+    line is rendered.
     """
     global style
+    if writer is None:
+        writer = console_writer_
     item_type = item["type"]
     if item_type != "message":
         return
@@ -27,7 +43,7 @@ def display_message_item(item, config, filecache, show_thread_id=False, no_files
     if user_info is None:
         user_name = user_id
     else:
-        user_name = user_info["name"]
+        user_name = user_info.name
     ts = item["ts"]
     dt = datetime.datetime.fromtimestamp(float(ts))
     fts = dt.strftime("%Y-%m-%d %H:%M:%S")
@@ -39,7 +55,7 @@ def display_message_item(item, config, filecache, show_thread_id=False, no_files
         parts.append(rf"[thread]\[{escape(ts)}][/thread]")
     parts.append(ftext)
     message = " ".join(parts)
-    console.print(message)
+    writer.markup(message)
     if no_files:
         return
     files = item.get("files", [])
@@ -48,19 +64,41 @@ def display_message_item(item, config, filecache, show_thread_id=False, no_files
         if is_external:
             link = escape(file_info["permalink_public"])
             name = escape(file_info["name"])
-            console.print(f"[hyperlink][link={link}]{name} ({link})[/link][/hyperlink]")
+            writer.markup(f"[hyperlink][link={link}]{name} ({link})[/link][/hyperlink]")
+            continue
+        is_image = file_info.get("mimetype") in image_types
+        if is_image and not writer.images:
+            # Images would not be displayed, so don't download them.
+            writer.markup(f"[file]{escape(file_info['name'])} (not cached)[/file]")
+            continue
+        if is_image and image_handler is not None:
+            image_handler(item, file_info)
             continue
         file_data = get_file(filecache, config, file_info)
         if file_data is None:
             continue
         name = file_info["name"]
         mimetype = file_info["mimetype"]
-        if mimetype in image_types:
-            display_image(file_data)
-            console.print(f"[file]{escape(name)}[/file]")
+        if mimetype in image_types and writer.images:
+            with file_data:
+                output = render_image(file_data, db=get_render_db(config, filecache))
+            writer.raw(output)
+            writer.markup(f"[file]{escape(name)}[/file]")
         else:
+            file_data.close()
             file_id = file_info["id"]
-            console.print(f"[file]{escape(name)} (file ID: {escape(file_id)})[/file]")
+            writer.markup(f"[file]{escape(name)} (file ID: {escape(file_id)})[/file]")
+
+
+def get_render_db(config, filecache):
+    """
+    Return the DB in which rendered images are persisted, or None if they
+    are only cached in memory.
+    """
+    images_cfg = config.get("images", {})
+    if images_cfg.get("persist_renders", False):
+        return filecache
+    return None
 
 
 def format_text_item(item):
@@ -68,74 +106,204 @@ def format_text_item(item):
     Format a Slack text item.
     Return the formatted text.
     """
+    return render_text_item_(item, element_formatters_)
+
+
+def render_text_item_(item, formatters):
+    """
+    Render the inner elements of the blocks of a Slack text item with the
+    formatter for each element type in `formatters`.
+    Elements of other types are skipped.
+    """
     parts = []
-    blocks = item.get("blocks", [])
-    for block in blocks:
-        outer_elements = block["elements"]
-        for outer_element in outer_elements:
-            inner_elements = outer_element["elements"]
-            for inner_element in inner_elements:
-                elm_type = inner_element["type"]
-                if elm_type == "text":
-                    parts.append(escape(inner_element["text"]))
-                elif elm_type == "link":
-                    try:
-                        link = inner_element["url"]
-                    except KeyError:
-                        inspect(inner_element)
-                        raise
-                    text = inner_element.get("text", link)
-                    link = escape(link)
-                    text = escape(text)
-                    markup = (
-                        f"[hyperlink][link={link}]{text} ({link})[/link][/hyperlink]"
-                    )
-                    parts.append(markup)
-                elif elm_type == "emoji":
-                    emoji = construct_emoji(inner_element)
-                    parts.append(emoji)
-                elif elm_type == "user":
-                    user = construct_user(inner_element)
-                    parts.append(user)
-                elif elm_type == "channel":
-                    channel = construct_channel(inner_element)
-                    parts.append(channel)
+    append = parts.append
+    for block in item.get("blocks", []):
+        for outer_element in block["elements"]:
+            for inner_element in outer_element["elements"]:
+                formatter = formatters.get(inner_element["type"])
+                if formatter is not None:
+                    append(formatter(inner_element))
     return "".join(parts)
 
 
+def construct_text(element):
+    """
+    Construct text from a message element.
+    """
+    return escape(element["text"])
+
+
+def construct_link(element):
+    """
+    Construct a hyperlink from a message element.
+    """
+    link, text = get_link_parts_(element)
+    link = escape(link)
+    text = escape(text)
+    return f"[hyperlink][link={link}]{text} ({link})[/link][/hyperlink]"
+
+
+def plain_text_item(item):
+    """
+    Return the text of a Slack text item without markup.
+    Links, user mentions, and channel mentions are rendered as plain text.
+    Items without blocks fall back to their `text` field.
+    """
+    if "blocks" not in item:
+        return item.get("text", "")
+    return render_text_item_(item, plain_element_formatters_)
+
+
+def plain_text(element):
+    """
+    Construct plain text from a message element.
+    """
+    return element["text"]
+
+
+def plain_link(element):
+    """
+    Construct a plain text link from a message element.
+    """
+    link, text = get_link_parts_(element)
+    if text == link:
+        return link
+    return f"{text} ({link})"
+
+
+def plain_emoji(element):
+    """
+    Construct a plain text emoji from a message element.
+    """
+    return f":{element['name']}:"
+
+
+def plain_user(element):
+    """
+    Construct a plain text user mention from a message element.
+    """
+    return f"@{get_user_name_(element['user_id'])}"
+
+
+def plain_channel(element):
+    """
+    Construct a plain text channel mention from a message element.
+    """
+    return f"#{get_channel_name_(element['channel_id'])}"
+
+
+def get_link_parts_(element):
+    """
+    Return the (url, text) of a link element.
+    """
+    try:
+        link = element["url"]
+    except KeyError:
+        inspect(element)
+        raise
+    text = element.get("text", link)
+    return link, text
+
+
 def construct_channel(element):
     """
     Construct a channel from a message element.
+    The markup is memoized until the channel's directory entry changes.
     """
     channel_id = element["channel_id"]
     channel_info = get_channel_info(channel_id)
+    cached = channel_markup_cache_.get(channel_id)
+    if cached is not None and cached[0] is channel_info:
+        return cached[1]
     if channel_info is None:
         channel = channel_id
     else:
-        channel = channel_info["name"]
-    return f"[channel]#{escape(channel)}[/channel]"
+        channel = channel_info.name
+    markup = f"[channel]#{escape(channel)}[/channel]"
+    channel_markup_cache_[channel_id] = (channel_info, markup)
+    return markup
+
+
+def get_channel_name_(channel_id):
+    """
+    Return the name of the channel, or its ID if the name is not known.
+    """
+    channel_info = get_channel_info(channel_id)
+    if channel_info is None:
+        return channel_id
+    return channel_info.name
 
 
 def construct_user(element):
     """
     Construct a user from a message element.
+    The markup is memoized until the user's directory entry changes.
     """
     user_id = element["user_id"]
     user_info = get_user_info(user_id)
+    cached = user_markup_cache_.get(user_id)
+    if cached is not None and cached[0] is user_info:
+        return cached[1]
     if user_info is None:
         username = user_id
     else:
-        username = user_info["name"]
-    return f"[user]@{escape(username)}[/user]"
+        username = user_info.name
+    markup = f"[user]@{escape(username)}[/user]"
+    user_markup_cache_[user_id] = (user_info, markup)
+    return markup
+
+
+def get_user_name_(user_id):
+    """
+    Return the name of the user, or their ID if the name is not known.
+    """
+    user_info = get_user_info(user_id)
+    if user_info is None:
+        return user_id
+    return user_info.name
 
 
 def construct_emoji(element):
     """
     Construct an emoji from `element`.
     """
-    unicode_hex = element.get("unicode")
+    return construct_emoji_(element.get("name"), element.get("unicode"))
+
+
+@functools.lru_cache(maxsize=4096)
+def construct_emoji_(name, unicode_hex):
+    """
+    Construct an emoji from its name and unicode code points.
+    """
     if unicode_hex is None:
-        return f":{element['name']}:"
+        return f":{name}:"
     hexes = unicode_hex.split("-")
     parts = [chr(int(code, 16)) for code in hexes]
     return "".join(parts)
+
+
+console_writer_ = ConsoleWriter(console)
+
+# Mention markup memoized by ID, along with the directory entry it was built
+# from.
+user_markup_cache_ = {}
+channel_markup_cache_ = {}
+
+# Formatters for each type of message element.
+element_formatters_ = {
+    "text": construct_text,
+    "link": construct_link,
+    "emoji": construct_emoji,
+    "user": construct_user,
+    "channel": construct_channel,
+}
+
+# Plain text formatters for each type of message element.  These must cover
+# the same element types as `element_formatters_`.
+plain_element_formatters_ = {
+    "text": plain_text,
+    "link": plain_link,
+    "emoji": plain_emoji,
+    "user": plain_user,
+    "channel": plain_channel,
+}
@@ -0,0 +1,245 @@
+import json
+
+from slackcli.api import get_client, page_results
+from slackcli.message import plain_text_item
+
+HISTORY_PAGE_LIMIT = 200
+
+
+def create_tables_(db):
+    """
+    Create message store tables.
+    """
+    cur = db.cursor()
+    sql = """\
+          CREATE TABLE IF NOT EXISTS messages(channel_id TEXT, ts TEXT,
+            posted NUMERIC, message TEXT, PRIMARY KEY (channel_id, ts))
+          """
+    cur.execute(sql)
+    sql = """\
+          CREATE TABLE IF NOT EXISTS message_sync(channel_id TEXT PRIMARY KEY,
+            synced_oldest NUMERIC)
+          """
+    cur.execute(sql)
+    sql = """\
+          SELECT name
+          FROM sqlite_master
+          WHERE name = 'messages_fts'
+          """
+    cur.execute(sql)
+    has_index = cur.fetchone() is not None
+    sql = """\
+          CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(body)
+          """
+    cur.execute(sql)
+    db.commit()
+    if not has_index:
+        reindex_messages(db)
+
+
+def query_history(config, channel_id, oldest, limit=HISTORY_PAGE_LIMIT):
+    """
+    Generator produces messages posted to the channel specified by channel ID
+    after the timestamp `oldest`.
+    Messages are produced in the order the API returns them, newest first.
+    """
+    client = get_client(config)
+    params = {"channel": channel_id, "limit": limit, "oldest": oldest}
+    for json_response in page_results(
+        client.get, "conversations.history", params=params
+    ):
+        messages = json_response["messages"]
+        for message in messages:
+            yield message
+
+
+def sync_channel_history(db, config, channel_id, oldest, resync=False):
+    """
+    Bring the stored history for the channel specified by channel ID up to
+    date from `oldest` onward.
+
+    If the store already covers `oldest`, only messages newer than the stored
+    high-water mark are fetched.  Otherwise, or if `resync` is True, the whole
+    range is fetched again.  Messages fetched in one sync are committed
+    together so an interrupted sync never leaves a gap below the high-water
+    mark.
+    Edits and deletions of messages that are already stored are not picked up
+    unless the range is resynced.
+    """
+    create_tables_(db)
+    synced_oldest = get_synced_oldest_(db, channel_id)
+    if resync or synced_oldest is None or synced_oldest > oldest:
+        fetch_from = oldest
+        synced_oldest = oldest
+    else:
+        fetch_from = get_high_water_mark_(db, channel_id) or oldest
+    cur = db.cursor()
+    for message in query_history(config, channel_id, fetch_from):
+        store_message_(cur, channel_id, message)
+    sql = """\
+          REPLACE INTO message_sync(channel_id, synced_oldest)
+          VALUES (?, ?)
+          """
+    cur.execute(sql, [channel_id, synced_oldest])
+    db.commit()
+
+
+def store_message_(cur, channel_id, message):
+    """
+    Store a message and index its text for full-text search.
+    The caller is responsible for committing.
+    """
+    ts = message["ts"]
+    sql = """\
+          INSERT INTO messages(channel_id, ts, posted, message)
+          VALUES (?, ?, ?, ?)
+          ON CONFLICT(channel_id, ts) DO UPDATE SET message = excluded.message
+          """
+    cur.execute(sql, [channel_id, ts, float(ts), json.dumps(message)])
+    sql = """\
+          SELECT rowid
+          FROM messages
+          WHERE channel_id = ?
+            AND ts = ?
+          """
+    cur.execute(sql, [channel_id, ts])
+    (rowid,) = cur.fetchone()
+    sql = """\
+          INSERT OR REPLACE INTO messages_fts(rowid, body)
+          VALUES (?, ?)
+          """
+    cur.execute(sql, [rowid, plain_text_item(message)])
+
+
+def reindex_messages(db):
+    """
+    Rebuild the full-text index from the stored messages.
+    """
+    cur = db.cursor()
+    cur.execute("DELETE FROM messages_fts")
+    sql = """\
+          SELECT rowid,
+                 message
+          FROM messages
+          """
+    rows = cur.execute(sql).fetchall()
+    sql = """\
+          INSERT INTO messages_fts(rowid, body)
+          VALUES (?, ?)
+          """
+    cur.executemany(
+        sql, [(rowid, plain_text_item(json.loads(message))) for rowid, message in rows]
+    )
+    db.commit()
+
+
+def search_messages(
+    db, query, channel_id=None, user_id=None, earliest=None, latest=None, limit=None
+):
+    """
+    Generator produces (channel_id, message) for stored messages matching the
+    full-text `query`, oldest first.
+    Results can be restricted to a channel, a user, and a range of posting
+    timestamps.  If `limit` is given, only the most recent `limit` matches are
+    produced.
+    """
+    create_tables_(db)
+    conditions = ["messages_fts MATCH ?"]
+    params = [query]
+    if channel_id is not None:
+        conditions.append("m.channel_id = ?")
+        params.append(channel_id)
+    if user_id is not None:
+        conditions.append("json_extract(m.message, '$.user') = ?")
+        params.append(user_id)
+    if earliest is not None:
+        conditions.append("m.posted >= ?")
+        params.append(earliest)
+    if latest is not None:
+        conditions.append("m.posted < ?")
+        params.append(latest)
+    where = " AND ".join(conditions)
+    if limit is None:
+        limit = -1
+    params.append(limit)
+    sql = f"""\
+          SELECT channel_id,
+                 message
+          FROM (SELECT m.channel_id,
+                       m.message,
+                       m.posted
+                FROM messages_fts
+                JOIN messages m ON m.rowid = messages_fts.rowid
+                WHERE {where}
+                ORDER BY m.posted DESC
+                LIMIT ?)
+          ORDER BY posted
+          """
+    cur = db.cursor()
+    cur.execute(sql, params)
+    while True:
+        results = cur.fetchmany()
+        if len(results) == 0:
+            break
+        for channel_id, message in results:
+            yield channel_id, json.loads(message)
+
+
+def get_stored_messages(db, channel_id, oldest):
+    """
+    Generator produces stored messages for the channel specified by channel ID
+    posted after the timestamp `oldest`, oldest first.
+    """
+    sql = """\
+          SELECT message
+          FROM messages
+          WHERE channel_id = ?
+            AND posted > ?
+          ORDER BY posted
+          """
+    cur = db.cursor()
+    cur.execute(sql, [channel_id, oldest])
+    while True:
+        results = cur.fetchmany()
+        if len(results) == 0:
+            break
+        for (message,) in results:
+            yield json.loads(message)
+
+
+def get_synced_oldest_(db, channel_id):
+    """
+    Return the oldest timestamp from which the stored history of the channel
+    is complete, or None if the channel has never been synced.
+    """
+    sql = """\
+          SELECT synced_oldest
+          FROM message_sync
+          WHERE channel_id = ?
+          """
+    cur = db.cursor()
+    cur.execute(sql, [channel_id])
+    row = cur.fetchone()
+    if row is None:
+        return None
+    return row[0]
+
+
+def get_high_water_mark_(db, channel_id):
+    """
+    Return the `ts` of the newest stored message for the channel, or None if
+    no messages are stored.
+    """
+    sql = """\
+          SELECT ts
+          FROM messages
+          WHERE channel_id = ?
+          ORDER BY posted DESC
+          LIMIT 1
+          """
+    cur = db.cursor()
+    cur.execute(sql, [channel_id])
+    row = cur.fetchone()
+    if row is None:
+        return None
+    return row[0]
@@ -0,0 +1,146 @@
+from rich.text import Text
+
+DEFAULT_BATCH_SIZE = 200
+
+
+class ConsoleWriter:
+    """
+    Writes each rendered line to the console as soon as it is rendered.
+    """
+
+    images = True
+
+    def __init__(self, console):
+        self.console = console
+
+    def markup(self, markup):
+        """
+        Write a line of console markup.
+        """
+        self.console.print(markup)
+
+    def raw(self, output):
+        """
+        Write pre-rendered terminal output, such as an image.
+        """
+        print(output)
+
+    def flush(self):
+        """
+        Write any pending output.
+        """
+
+
+class BatchWriter:
+    """
+    Accumulates rendered lines and writes them to the console in batches, so
+    the console renders and flushes once per batch instead of once per line.
+    """
+
+    images = True
+
+    def __init__(self, console, batch_size=DEFAULT_BATCH_SIZE, pager=False):
+        self.console = console
+        self.batch_size = batch_size
+        self.pager = pager
+        self.lines = []
+
+    def markup(self, markup):
+        """
+        Write a line of console markup.
+        """
+        self.lines.append(Text.from_markup(markup))
+        if len(self.lines) >= self.batch_size:
+            self.flush()
+
+    def raw(self, output):
+        """
+        Write pre-rendered terminal output, such as an image.
+        Pending lines are written first to keep the output in order.
+        """
+        self.flush()
+        if self.pager:
+            # Output sent to the pager is captured by the console.
+            self.console.print(Text.from_ansi(output))
+        else:
+            print(output)
+
+    def flush(self):
+        """
+        Write any pending output.
+        """
+        if len(self.lines) == 0:
+            return
+        self.console.print(Text("\n").join(self.lines))
+        self.lines = []
+
+
+class PlainWriter:
+    """
+    Writes rendered lines as plain text without styles, for output that is
+    not a terminal.
+    Images are not rendered.
+    """
+
+    images = False
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def markup(self, markup):
+        """
+        Write a line of console markup as plain text.
+        """
+        self.stream.write(Text.from_markup(markup).plain)
+        self.stream.write("\n")
+
+    def raw(self, output):
+        """
+        Discard pre-rendered terminal output.
+        """
+
+    def flush(self):
+        """
+        Write any pending output.
+        """
+        self.stream.flush()
+
+
+class BufferWriter:
+    """
+    Buffers rendered output so it can be written later in one piece, e.g.
+    while holding a lock shared by several rendering threads.
+    """
+
+    images = True
+
+    def __init__(self):
+        self.entries = []
+
+    def markup(self, markup):
+        """
+        Buffer a line of console markup.
+        """
+        self.entries.append((True, markup))
+
+    def raw(self, output):
+        """
+        Buffer pre-rendered terminal output, such as an image.
+        """
+        self.entries.append((False, output))
+
+    def write_to(self, writer):
+        """
+        Write the buffered output to `writer` and clear the buffer.
+        """
+        for is_markup, entry in self.entries:
+            if is_markup:
+                writer.markup(entry)
+            else:
+                writer.raw(entry)
+        self.entries = []
+
+    def flush(self):
+        """
+        Buffered output is only written by `write_to()`.
+        """
@@ -0,0 +1,95 @@
+import collections
+import concurrent.futures
+import threading
+
+from slackcli.filecache import get_file, open_filecache
+
+DEFAULT_PREFETCH_WORKERS = 4
+DEFAULT_PREFETCH_WINDOW = 50
+
+
+def prefetch_message_files(
+    items,
+    config,
+    workspace,
+    workers=DEFAULT_PREFETCH_WORKERS,
+    window=DEFAULT_PREFETCH_WINDOW,
+):
+    """
+    Generator produces message `items` in order once the files attached to
+    each one have been downloaded into the file cache.
+
+    Files are downloaded concurrently by a pool of `workers` threads, scanning
+    up to `window` messages ahead of the one being produced, so rendering the
+    produced messages only reads from the cache.  Download errors are ignored
+    here; they surface again when the message is rendered.
+    """
+    local = threading.local()
+    # Connections opened by the pool threads, closed once the pool has shut
+    # down.
+    connections = []
+    connections_lock = threading.Lock()
+
+    def fetch(file_info):
+        db = getattr(local, "db", None)
+        if db is None:
+            db = open_filecache(workspace)
+            local.db = db
+            with connections_lock:
+                connections.append(db)
+        try:
+            file_data = get_file(db, config, file_info)
+        except Exception:
+            return
+        if file_data is not None:
+            file_data.close()
+
+    submitted = {}
+    pending = collections.deque()
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            for item in items:
+                futures = []
+                for file_info in get_cacheable_files_(item):
+                    file_id = file_info["id"]
+                    future = submitted.get(file_id)
+                    if future is None:
+                        future = executor.submit(fetch, file_info)
+                        submitted[file_id] = future
+                    futures.append(future)
+                pending.append((item, futures))
+                while len(pending) > 0 and (
+                    len(pending) > window or is_done_(pending[0][1])
+                ):
+                    head, head_futures = pending.popleft()
+                    concurrent.futures.wait(head_futures)
+                    yield head
+            while len(pending) > 0:
+                head, head_futures = pending.popleft()
+                concurrent.futures.wait(head_futures)
+                yield head
+    finally:
+        for db in connections:
+            db.close()
+
+
+def get_cacheable_files_(item):
+    """
+    Generator produces the file info of each file attached to a message that
+    can be downloaded into the file cache.
+    """
+    if item.get("type") != "message":
+        return
+    for file_info in item.get("files", []):
+        if file_info.get("is_external", False):
+            continue
+        if file_info.get("mode") == "tombstone":
+            continue
+        yield file_info
+
+
+def is_done_(futures):
+    """
+    Return True if all `futures` are done.
+    """
+    return all(future.done() for future in futures)
@@ -0,0 +1,175 @@
+import random
+import threading
+import time
+
+# Requests per minute allowed for each Slack rate limit tier.
+TIER_RATES = {1: 1, 2: 20, 3: 50, 4: 100}
+METHOD_TIERS = {
+    "chat.postMessage": None,
+    "conversations.history": 3,
+    "conversations.info": 3,
+    "conversations.list": 2,
+    "conversations.mark": 3,
+    "files.info": 4,
+    "files.upload": 2,
+    "pins.list": 2,
+    "users.info": 4,
+    "users.list": 2,
+}
+# Methods with special rate limits, in requests per minute.
+SPECIAL_RATES = {"chat.postMessage": 60}
+DEFAULT_TIER = 3
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_RETRY_AFTER = 1.0
+# Fraction of a minute's allowance that may be spent in a burst.
+BURST_FRACTION = 1 / 6
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at `rate` tokens per second.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Take a token and return the number of seconds the caller must wait
+        before using it.
+        Tokens may be borrowed against future refills so that concurrent
+        callers are queued in the order they arrive.
+        """
+        with self.lock:
+            now = time.monotonic()
+            elapsed = now - self.updated
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = 0.0
+            if self.tokens < 0:
+                wait = -self.tokens / self.rate
+            return max(wait, self.blocked_until - now)
+
+    def block(self, seconds):
+        """
+        Stop handing out usable tokens for `seconds`.
+        """
+        with self.lock:
+            blocked_until = time.monotonic() + seconds
+            self.blocked_until = max(self.blocked_until, blocked_until)
+
+
+class RequestScheduler:
+    """
+    Schedules Slack Web API requests so they stay within the rate limit tier
+    of each method.
+    Responses with HTTP status 429 are retried after the `Retry-After`
+    interval plus a random jitter.
+    """
+
+    def __init__(self, config):
+        rate_cfg = config.get("rate_limits", {})
+        self.max_retries = rate_cfg.get("max_retries", DEFAULT_MAX_RETRIES)
+        self.method_rates = rate_cfg.get("methods", {})
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.stats = {
+            "requests": 0,
+            "throttled": 0,
+            "rate_limited": 0,
+            "retried": 0,
+        }
+
+    def request(self, method, send, retry=True):
+        """
+        Call `send` to issue a request for API `method` once the method's rate
+        limit allows it and return the response.
+        If `method` is None, the request is not rate limited, but it is still
+        retried when Slack responds with status 429.
+        If `retry` is False, a 429 response is returned without retrying.
+        """
+        bucket = None
+        if method is not None:
+            bucket = self.get_bucket_(method)
+        attempt = 0
+        while True:
+            if bucket is not None:
+                wait = bucket.reserve()
+                if wait > 0:
+                    self.count_("throttled")
+                    time.sleep(wait)
+            response = send()
+            self.count_("requests")
+            if response.status_code != 429:
+                return response
+            self.count_("rate_limited")
+            if not retry or attempt >= self.max_retries:
+                return response
+            delay = get_backoff_delay_(response, attempt)
+            response.close()
+            if bucket is not None:
+                bucket.block(delay)
+            time.sleep(delay)
+            self.count_("retried")
+            attempt += 1
+
+    def get_stats(self):
+        """
+        Return a copy of the request counters.
+        """
+        with self.lock:
+            return dict(self.stats)
+
+    def get_bucket_(self, method):
+        """
+        Return the token bucket for API `method`.
+        """
+        with self.lock:
+            bucket = self.buckets.get(method)
+            if bucket is None:
+                per_minute = self.get_method_rate_(method)
+                capacity = max(1, int(per_minute * BURST_FRACTION))
+                bucket = TokenBucket(per_minute / 60, capacity)
+                self.buckets[method] = bucket
+            return bucket
+
+    def get_method_rate_(self, method):
+        """
+        Return the number of requests per minute allowed for API `method`.
+        """
+        rate = self.method_rates.get(method)
+        if rate is not None:
+            return rate
+        rate = SPECIAL_RATES.get(method)
+        if rate is not None:
+            return rate
+        tier = METHOD_TIERS.get(method, DEFAULT_TIER)
+        return TIER_RATES[tier]
+
+    def count_(self, name):
+        """
+        Increment counter `name`.
+        """
+        with self.lock:
+            self.stats[name] += 1
+
+
+def get_backoff_delay_(response, attempt):
+    """
+    Return the number of seconds to wait before retrying a rate limited
+    request.
+    The delay is the larger of the `Retry-After` header and an exponential
+    backoff for `attempt`, plus up to one second of jitter.
+    """
+    try:
+        retry_after = float(response.headers.get("Retry-After", DEFAULT_RETRY_AFTER))
+    except ValueError:
+        retry_after = DEFAULT_RETRY_AFTER
+    backoff = DEFAULT_RETRY_AFTER * 2**attempt
+    return max(retry_after, backoff) + random.uniform(0, 1)
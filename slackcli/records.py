@@ -0,0 +1,84 @@
+import json
+
+from slackcli.message import plain_text_item
+from slackcli.user import get_user_info
+
+RECORD_FORMATS = ("jsonl", "tsv", "raw")
+
+
+class RecordWriter:
+    """
+    Writes one machine-readable record per message, without building markup
+    or rendering to the console.
+
+    Formats:
+
+    - jsonl: The message payload as a line of JSON, with its channel ID.
+    - tsv: Channel ID, ts, user ID, user name, thread ts, and plain text,
+      separated by tabs.
+    - raw: The plain text of the message.
+
+    Tabs, newlines, and backslashes in tsv and raw fields are escaped so each
+    record stays on one line.
+    """
+
+    def __init__(self, stream, format_name):
+        self.stream = stream
+        self.format_record = getattr(self, f"format_{format_name}_")
+
+    def write(self, channel_id, item):
+        """
+        Write a record for a message posted to the channel.
+        """
+        self.stream.write(self.format_record(channel_id, item))
+        self.stream.write("\n")
+
+    def flush(self):
+        """
+        Write any pending output.
+        """
+        self.stream.flush()
+
+    def format_jsonl_(self, channel_id, item):
+        """
+        Format a jsonl record.
+        """
+        if "channel" not in item:
+            item = dict(item, channel=channel_id)
+        return json.dumps(item)
+
+    def format_tsv_(self, channel_id, item):
+        """
+        Format a tsv record.
+        """
+        user_id = item.get("user", "")
+        user_info = get_user_info(user_id)
+        if user_info is None:
+            user_name = user_id
+        else:
+            user_name = user_info.name
+        fields = [
+            channel_id,
+            item["ts"],
+            user_id,
+            user_name,
+            item.get("thread_ts", ""),
+            plain_text_item(item),
+        ]
+        return "\t".join(escape_field_(field) for field in fields)
+
+    def format_raw_(self, channel_id, item):
+        """
+        Format a raw record.
+        """
+        return escape_field_(plain_text_item(item))
+
+
+def escape_field_(field):
+    """
+    Escape backslashes, tabs, and newlines in a record field.
+    """
+    return field.translate(field_escapes_)
+
+
+field_escapes_ = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
@@ -1,49 +1,98 @@
-import httpx
+import sys
+from typing import NamedTuple
+
 from rich import inspect
 
-user_map_ = None
+from slackcli.api import get_client, page_results
+
+PAGE_LIMIT = 1000
+
+
+class UserInfo(NamedTuple):
+    """
+    Directory entry for a user.
+    """
+
+    name: str
+    is_admin: bool
+    is_bot: bool
+    is_owner: bool
+    is_primary_owner: bool
+    tz: str
+
+
+class UserDirectory(NamedTuple):
+    """
+    Loaded users along with an index for looking them up by name.
+    """
+
+    # User ID to UserInfo.
+    users: dict
+    # User name to user ID.
+    ids_by_name: dict
+
 
+user_directory_ = UserDirectory({}, {})
 
-def load_users(config):
+
+def set_users(user_map):
+    """
+    Replace the loaded users with `user_map`, a mapping of user ID to
+    UserInfo, and index them.
     """
-    Get users.
+    global user_directory_
+    ids_by_name = {}
+    for user_id, user_info in user_map.items():
+        ids_by_name.setdefault(user_info.name, user_id)
+    user_directory_ = UserDirectory(user_map, ids_by_name)
+
+
+def fetch_users(config):
     """
-    global user_map_
-    user_map_ = {}
-    url = "https://slack.com/api/users.list"
-    user_token = config["oauth"]["user_token"]
-    headers = {"Authorization": f"Bearer {user_token}"}
-    response = httpx.get(url, headers=headers)
-    json_response = response.json()
-    try:
-        users = json_response["members"]
-    except KeyError:
-        inspect(json_response)
-        raise
-    for user in users:
+    Query users and return a mapping of user ID to UserInfo.
+    """
+    user_map = {}
+    client = get_client(config)
+    params = {"limit": PAGE_LIMIT}
+    for user in query_users_(client, params):
         user_id = user["id"]
         deleted = user["deleted"]
         if deleted:
             continue
-        user_info = {}
-        fields = [
-            "name",
-            "is_admin",
-            "is_bot",
-            "is_owner",
-            "is_primary_owner",
-            "tz",
-        ]
-        for field in fields:
-            user_info[field] = user[field]
-        user_map_[user_id] = user_info
+        user_map[user_id] = make_user_info(user)
+    return user_map
+
+
+def make_user_info(fields):
+    """
+    Return a UserInfo from a mapping of field names to values.
+    Time zone names are interned, since many users share each one.
+    """
+    user_info = UserInfo(*(fields[field] for field in UserInfo._fields))
+    if user_info.tz is not None:
+        user_info = user_info._replace(tz=sys.intern(user_info.tz))
+    return user_info
+
+
+def query_users_(client, params):
+    """
+    Generator pages through users and produces entries for each one.
+    """
+    for json_response in page_results(client.get, "users.list", params=params):
+        try:
+            users = json_response["members"]
+        except KeyError:
+            inspect(json_response)
+            raise
+        for user in users:
+            yield user
 
 
 def get_all_users():
     """
     Generator yields (user_id, user_info).
     """
-    for user_id, user_info in user_map_.items():
+    for user_id, user_info in user_directory_.users.items():
         yield user_id, user_info
 
 
@@ -51,15 +100,11 @@ def get_user_info(user_id):
     """
     Get the user name from the `user_id`.
     """
-    global user_map_
-    return user_map_.get(user_id)
+    return user_directory_.users.get(user_id)
 
 
 def get_user_id_by_username(username):
     """
     Get the user_id matching the given username.
     """
-    for user_id, user_info in user_map_.items():
-        if user_info["name"] == username:
-            return user_id
-    return None
+    return user_directory_.ids_by_name.get(username)